@@ -1,35 +1,134 @@
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
+import hashlib
+import threading
+from django.core.cache import caches
 
-# Linear Regression Model to Predict Prices for Given Town
-def predict_prices_for_town(df, town, years=5, base_year=2025, flat_type=None):
-    filtered_df = df[df['town'] == town.upper().strip()]
-    
-    if flat_type:
-        filtered_df = filtered_df[filtered_df['flat_type'] == flat_type.upper().replace("-", " ")]
+from .dataset import match_flat_types
+from .instrumentation import span
 
-    if filtered_df.empty:
-        return {"error": f"No data found for {town}"}
+# Closed-form OLS trend lines for every (town, flat_type) pair, fitted at once from the
+# yearly averages in the aggregate cube. Column -1 of each table is "all flat types".
+# A prediction is then a lookup plus a multiply instead of a model fit per request.
+class ForecastTable:
+    def __init__(self, towns, flat_types, slope, intercept, row_count, year_count):
+        self.towns = towns
+        self.flat_types = flat_types
+        self.slope = slope
+        self.intercept = intercept
+        self.row_count = row_count
+        self.year_count = year_count
 
-    yearly_avg = filtered_df.groupby('year')['resale_price'].mean().reset_index()
+    @classmethod
+    def from_cube(cls, cube):
+        years, count, total = cube.yearly_totals()
 
-    if len(yearly_avg) < 3:
-        return {"error": f"Not enough data to make prediction for {town}"}
+        # Append the "all flat types" series as an extra flat_type column
+        count = np.concatenate([count, count.sum(axis=1, keepdims=True)], axis=1)
+        total = np.concatenate([total, total.sum(axis=1, keepdims=True)], axis=1)
 
-    X = yearly_avg['year'].values.reshape(-1, 1)
-    y = yearly_avg['resale_price'].values
+        # Same points LinearRegression sees: one (year, mean price) per year with sales
+        observed = count > 0
+        x = np.where(observed, years.astype(np.float64), 0.0)
+        y = np.divide(total, count, out=np.zeros(total.shape), where=observed)
+        n = observed.sum(axis=2)
 
-    model = LinearRegression()
-    model.fit(X, y)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x_mean = x.sum(axis=2) / n
+            y_mean = y.sum(axis=2) / n
+            dx = np.where(observed, x - x_mean[..., None], 0.0)
+            dy = np.where(observed, y - y_mean[..., None], 0.0)
+            slope = (dx * dy).sum(axis=2) / (dx * dx).sum(axis=2)
+        intercept = y_mean - slope * x_mean
 
-    future_years = np.array([base_year + i for i in range(years)]).reshape(-1, 1)
-    predicted_prices = model.predict(future_years)
+        return cls(cube.towns, cube.flat_types, slope, intercept, count.sum(axis=2), n)
 
-    return {
-        "town": town,
-        "predictions": [
-            {"year": int(year), "predicted_price": round(price, 2)}
-            for year, price in zip(future_years.flatten(), predicted_prices)
-        ]
-    }
\ No newline at end of file
+    # Forecast of the yearly mean price of a town (and flat type) for `years` years from
+    # base_year, from a linear fit of its yearly averages
+    def predict(self, town, years=5, base_year=2025, flat_type=None):
+        town_pos = np.flatnonzero(self.towns == town.upper().strip())
+        flat_type_pos = [-1]
+        if flat_type:
+            flat_type_pos = pd.Index(self.flat_types).get_indexer(match_flat_types(self.flat_types, [flat_type]))
+
+        if not len(town_pos) or not len(flat_type_pos) or not self.row_count[town_pos[0], flat_type_pos[0]]:
+            return {"error": f"No data found for {town}"}
+
+        series = (town_pos[0], flat_type_pos[0])
+        if self.year_count[series] < 3:
+            return {"error": f"Not enough data to make prediction for {town}"}
+
+        future_years = np.arange(base_year, base_year + years)
+        predicted_prices = self.intercept[series] + self.slope[series] * future_years
+
+        return {
+            "town": town,
+            "predictions": [
+                {"year": int(year), "predicted_price": round(float(price), 2)}
+                for year, price in zip(future_years, predicted_prices)
+            ]
+        }
+
+    # Forecasts for many towns in one call; towns=None means every town. Results come in
+    # town order with each town once, named in upper case, whatever order or case the towns
+    # were given in (the response cache treats such requests as the same one).
+    def predict_many(self, towns=None, years=5, base_year=2025, flat_type=None, cache=None):
+        if towns is None:
+            towns = self.towns.tolist()
+        else:
+            towns = sorted(set(town.strip().upper() for town in towns))
+
+        results = []
+        for town in towns:
+            if cache is None:
+                result = self.predict(town, years=years, base_year=base_year, flat_type=flat_type)
+            else:
+                result = cache.get_or_compute(self.predict, town, years=years, base_year=base_year, flat_type=flat_type)
+            if "error" in result:
+                result = {"town": town, **result}
+            results.append(result)
+        return results
+
+
+# Forecasts keyed on (town, flat_type, base_year, years) and the dataset version, stored in
+# the Django cache named by FORECAST_CACHE_ALIAS. The backend bounds the size and evicts
+# least recently used entries; a shared backend (file-based, Redis) shares them across
+# workers. Entries of an older dataset version are never read again and age out under the
+# alias's eviction and TIMEOUT; the cache is never cleared, as the alias may be shared.
+FORECAST_CACHE_ALIAS = 'forecasts'
+
+
+class ForecastCache:
+    def __init__(self, version, alias=FORECAST_CACHE_ALIAS):
+        self.version = version
+        self.cache = caches[alias]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _key(self, town, flat_type, base_year, years):
+        raw = repr((self.version, town, flat_type, base_year, years))
+        return 'forecast:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    # Cached result of compute(town, years=..., base_year=..., flat_type=...). The town is
+    # uppercased first, so "bedok" and "BEDOK" share one entry (and name the town alike).
+    def get_or_compute(self, compute, town, years=5, base_year=2025, flat_type=None):
+        town = town.strip().upper()
+        key = self._key(town, flat_type, base_year, years)
+        result = self.cache.get(key)
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if result is None:
+            with span('forecast'):
+                result = compute(town, years=years, base_year=base_year, flat_type=flat_type)
+            self.cache.set(key, result)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'version': self.version, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+
+from .dataset import match_flat_types
+
+# Lease decay curve of the lease-adjusted price: a lease is valued like an annuity over its
+# remaining years at this discount rate, relative to a fresh 99-year lease
+LEASE_DISCOUNT_RATE = 0.035
+FULL_LEASE_YEARS = 99
+
+# Quantiles kept per cell, with pandas' default (linear) interpolation
+QUANTILES = {'p10': 0.1, 'p50': 0.5, 'p90': 0.9}
+
+LEASE_PATTERN = r'^\s*(\d+)(?:\s*years?)?(?:\s*(\d+)\s*months?)?\s*$'
+
+
+# Remaining lease in whole months (-1 where it cannot be read). Accepts "61 years 04 months",
+# "70 years" and bare year counts. A categorical column is parsed once per distinct label
+# and mapped back through its codes.
+def remaining_lease_months(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        by_code = np.append(_lease_label_months(column.cat.categories.astype(str).to_series()), -1)
+        return by_code[column.cat.codes.to_numpy()]
+    return _lease_label_months(column.astype(str))
+
+
+def _lease_label_months(labels):
+    parts = labels.str.extract(LEASE_PATTERN)
+    years = pd.to_numeric(parts[0], errors='coerce').to_numpy(dtype=np.float64)
+    months = pd.to_numeric(parts[1], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+    total = years * 12 + months
+    return np.where(np.isnan(total), -1, total).astype(np.int32)
+
+
+# Value of a lease with the given months left as a fraction of a full 99-year lease
+def lease_value_fraction(months):
+    discount = 1 + LEASE_DISCOUNT_RATE
+    years = np.asarray(months, dtype=np.float64) / 12
+    return (1 - discount ** -years) / (1 - discount ** -FULL_LEASE_YEARS)
+
+
+# Per-group linear-interpolated quantiles of values already sorted within each group;
+# starts/sizes locate the non-empty groups
+def _sorted_group_quantiles(values, starts, sizes, q):
+    position = (sizes - 1) * q
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    low_values = values[starts + low]
+    return low_values + (values[starts + high] - low_values) * (position - low)
+
+
+# Per town x flat_type x year price statistics computed once at load: mean price per sqm,
+# mean lease-adjusted price and the p10/p50/p90 prices. Index -1 of the flat_type axis is
+# "all flat types". Cells without sales hold NaN.
+class PriceAnalytics:
+    def __init__(self, towns, flat_types, first_year, count, values):
+        self.towns = towns
+        self.flat_types = flat_types
+        self.first_year = first_year
+        self.count = count
+        self.values = values
+
+    @classmethod
+    def from_frame(cls, df):
+        towns = np.asarray(df['town'].cat.categories, dtype=object)
+        flat_types = np.asarray(df['flat_type'].cat.categories, dtype=object)
+        years = df['year'].to_numpy()
+        first_year = int(years.min()) if len(df) else 0
+        shape = (len(towns), len(flat_types) + 1, int(years.max()) - first_year + 1 if len(df) else 0)
+        size = int(np.prod(shape))
+
+        # Every row lands in its own flat type's cell and in the "all flat types" cell
+        town_codes = df['town'].cat.codes.to_numpy()
+        flat_type_codes = df['flat_type'].cat.codes.to_numpy().astype(np.int64)
+        year_offsets = years - first_year
+        cells = np.concatenate([
+            np.ravel_multi_index((town_codes, flat_type_codes, year_offsets), shape),
+            np.ravel_multi_index((town_codes, np.full(len(df), len(flat_types)), year_offsets), shape),
+        ])
+
+        prices = df['resale_price'].to_numpy(dtype=np.float64)
+        area = df['floor_area_sqm'].to_numpy(dtype=np.float64)
+        lease_months = remaining_lease_months(df['remaining_lease'])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            per_sqm = np.where(area > 0, prices / area, np.nan)
+            adjusted = np.where(lease_months > 0, prices / lease_value_fraction(lease_months), np.nan)
+
+        count = np.bincount(cells, minlength=size)
+        values = {
+            'price_per_sqm': cls._cell_means(cells, np.tile(per_sqm, 2), size),
+            'lease_adjusted': cls._cell_means(cells, np.tile(adjusted, 2), size),
+        }
+
+        # Sort prices within each cell once, then read every quantile off the sorted runs
+        doubled = np.tile(prices, 2)
+        order = np.lexsort((doubled, cells))
+        sorted_prices = doubled[order]
+        present = np.flatnonzero(count)
+        starts = (np.cumsum(count) - count)[present]
+        for name, q in QUANTILES.items():
+            quantiles = np.full(size, np.nan)
+            quantiles[present] = _sorted_group_quantiles(sorted_prices, starts, count[present], q)
+            values[name] = quantiles
+
+        return cls(
+            towns, flat_types, first_year, count.reshape(shape),
+            {name: cell_values.reshape(shape) for name, cell_values in values.items()},
+        )
+
+    # Analytics after typed `rows` were added, given the new frame and its TownIndex. Only
+    # the town x year blocks the rows fall in are recomputed, from their rows of the new
+    # frame; every other cell is copied over (the axes grow with unseen labels or years).
+    def with_rows(self, df, town_index, rows):
+        towns = df['town'].cat.categories
+        touched = np.unique(np.column_stack([
+            towns.get_indexer(rows['town'].astype(object)), rows['year'].to_numpy(dtype=np.int64),
+        ]), axis=0)
+        town_pos, years = touched[:, 0], touched[:, 1]
+        part = PriceAnalytics.from_frame(df.iloc[town_index.range_rows(town_pos, (years - 1970) * 12, (years - 1970) * 12 + 11)])
+
+        flat_types = df['flat_type'].cat.categories
+        old_years = np.arange(self.first_year, self.first_year + self.count.shape[2])
+        first_year = min(int(years.min()), int(old_years.min())) if len(old_years) else int(years.min())
+        last_year = max(int(years.max()), int(old_years.max())) if len(old_years) else int(years.max())
+        shape = (len(towns), len(flat_types) + 1, last_year - first_year + 1)
+
+        # the "all flat types" column stays last
+        old_cells = np.ix_(
+            towns.get_indexer(self.towns),
+            np.append(flat_types.get_indexer(self.flat_types), len(flat_types)),
+            old_years - first_year,
+        )
+        new_cells = (town_pos, slice(None), years - first_year)
+        part_cells = (town_pos, slice(None), years - part.first_year)
+
+        def updated(old, new, fill):
+            values = np.full(shape, fill, dtype=old.dtype)
+            values[old_cells] = old
+            values[new_cells] = new[part_cells]
+            return values
+
+        return PriceAnalytics(
+            np.asarray(towns, dtype=object), np.asarray(flat_types, dtype=object), first_year,
+            updated(self.count, part.count, 0),
+            {name: updated(values, part.values[name], np.nan) for name, values in self.values.items()},
+        )
+
+    # Mean of the non-NaN values per cell
+    @staticmethod
+    def _cell_means(cells, values, size):
+        valid = ~np.isnan(values)
+        count = np.bincount(cells[valid], minlength=size)
+        total = np.bincount(cells[valid], weights=values[valid], minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    # One row per (town, year) with sales for the given towns and flat type (None for all;
+    # matched like query values), with a column per requested statistic, in town then year
+    # order
+    def summarise(self, names, towns, flat_type=None, start_year=None, end_year=None):
+        columns = ['town', 'year'] + list(names)
+        town_pos = pd.Index(self.towns).get_indexer(towns)
+        town_pos = np.unique(town_pos[town_pos >= 0])
+
+        if flat_type is None:
+            flat_type_pos = -1
+        else:
+            matches = pd.Index(self.flat_types).get_indexer(match_flat_types(self.flat_types, [flat_type]))
+            if not len(matches):
+                return pd.DataFrame(columns=columns)
+            flat_type_pos = matches[0]
+
+        last_year = self.first_year + self.count.shape[2] - 1
+        start = self.first_year if start_year is None else max(int(start_year), self.first_year)
+        end = last_year if end_year is None else min(int(end_year), last_year)
+        year_offsets = np.arange(start, end + 1) - self.first_year
+
+        count = self.count[town_pos, flat_type_pos][:, year_offsets]
+        town_index, year_index = np.nonzero(count)
+        result = {
+            'town': self.towns[town_pos][town_index],
+            'year': year_offsets[year_index] + self.first_year,
+        }
+        for name in names:
+            result[name] = self.values[name][town_pos, flat_type_pos][:, year_offsets][town_index, year_index]
+        return pd.DataFrame(result, columns=columns)
@@ -1,5 +1,44 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+# manage.py commands and server executables that serve requests
+SERVING_COMMANDS = ('runserver', 'runserver_plus')
+SERVING_EXECUTABLES = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'uwsgi')
+
+
+# Whether this process is going to serve requests (rather than run migrate, shell, test...)
+def is_serving(argv=None):
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return False
+    if os.path.basename(argv[0]) in ('manage.py', 'django-admin'):
+        # runserver's autoreloader parent only watches files; the child (RUN_MAIN) serves
+        return len(argv) > 1 and argv[1] in SERVING_COMMANDS and (
+            os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
+        )
+    return os.path.basename(argv[0]) in SERVING_EXECUTABLES
+
 
 class HdbResaleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'hdb_resale'
+
+    # Load the resale dataset up front when serving, so the first request does not pay for
+    # it; other management commands never touch the data file. RESALE_WARM_ON_STARTUP
+    # overrides the detection.
+    def ready(self):
+        warm = getattr(settings, 'RESALE_WARM_ON_STARTUP', None)
+        if warm is None:
+            warm = is_serving()
+        if not warm:
+            return
+
+        from .registry import registry
+
+        registry.current()
+        interval = getattr(settings, 'RESALE_DATASET_WATCH_INTERVAL', None)
+        if interval:
+            registry.watch(interval)
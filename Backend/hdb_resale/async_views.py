@@ -0,0 +1,119 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+
+from . import views
+from .profiling import call_sampled
+
+# Defaults for RESALE_ASYNC_THREADS, RESALE_ASYNC_MAX_IN_FLIGHT and RESALE_ASYNC_TIMEOUT
+DEFAULT_THREADS = 4
+DEFAULT_MAX_IN_FLIGHT = 32
+DEFAULT_TIMEOUT = 30.0
+
+_executor = None
+_in_flight = None
+_END = object()
+_setup_lock = threading.Lock()
+
+
+def _pool():
+    global _executor, _in_flight
+    if _executor is None:
+        with _setup_lock:
+            if _executor is None:
+                _in_flight = threading.BoundedSemaphore(getattr(settings, 'RESALE_ASYNC_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT))
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'RESALE_ASYNC_THREADS', DEFAULT_THREADS),
+                    thread_name_prefix='resale-async',
+                )
+    return _executor, _in_flight
+
+
+# Run the sync view in the worker thread, including rendering, so the event loop only
+# ever sends finished bytes
+def _call_view(view, request, args, kwargs):
+    try:
+        response = call_sampled(lambda: view(request, *args, **kwargs), request)
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+# Chunks of a sync streaming body, each produced in the thread pool, so a long stream
+# is sent chunk by chunk instead of being read whole into memory (as Django does with sync
+# iterators under ASGI). The request keeps its in-flight slot until the stream ends; a
+# chunk that takes longer than the timeout ends the stream.
+async def _pull_chunks(chunks, executor, in_flight, timeout):
+    iterator = iter(chunks)
+    pending = None
+    try:
+        while True:
+            pending = executor.submit(next, iterator, _END)
+            chunk = await asyncio.wait_for(asyncio.wrap_future(pending), timeout)
+            if chunk is _END:
+                break
+            yield chunk
+    finally:
+        # a chunk still being produced holds the slot until it is done
+        if pending is None:
+            in_flight.release()
+        else:
+            pending.add_done_callback(lambda _: in_flight.release())
+
+
+# Async counterpart of a sync resale view. The pandas/NumPy work runs in a bounded thread
+# pool (NumPy releases the GIL for most of it), so the event loop stays free for cheap
+# requests while heavy ones are in flight. At most RESALE_ASYNC_MAX_IN_FLIGHT requests are
+# admitted (running or queued for a thread); beyond that the view answers 503 at once.
+# A request that takes longer than RESALE_ASYNC_TIMEOUT seconds answers 504; its thread
+# still finishes the work, and keeps its in-flight slot until then. Streaming responses
+# are pulled through the pool as well (see _pull_chunks).
+def async_view(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        executor, in_flight = _pool()
+        if not in_flight.acquire(blocking=False):
+            return JsonResponse({'error': 'Server busy, try again shortly.'}, status=503, headers={'Retry-After': '1'})
+
+        context = contextvars.copy_context()
+        future = executor.submit(context.run, _call_view, view, request, args, kwargs)
+
+        timeout = getattr(settings, 'RESALE_ASYNC_TIMEOUT', DEFAULT_TIMEOUT)
+        try:
+            response = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except BaseException as error:
+            future.add_done_callback(lambda _: in_flight.release())
+            if isinstance(error, asyncio.TimeoutError):
+                return JsonResponse({'error': 'Request timed out.'}, status=504)
+            raise
+
+        if response.streaming and not response.is_async:
+            response.streaming_content = _pull_chunks(response.streaming_content, executor, in_flight, timeout)
+        else:
+            in_flight.release()
+        return response
+
+    return wrapper
+
+
+get_towns = async_view(views.get_towns)
+get_years = async_view(views.get_years)
+resale_analysis = async_view(views.resale_analysis)
+resale_comparison = async_view(views.resale_comparison)
+comparison_graph = async_view(views.comparison_graph)
+resale_trends = async_view(views.resale_trends)
+resale_roomtype_trends = async_view(views.resale_roomtype_trends)
+raw_data_by_town = async_view(views.raw_data_by_town)
+search_transactions = async_view(views.search_transactions)
+block_history = async_view(views.block_history)
+ai_price_prediction = async_view(views.ai_price_prediction)
+ai_price_prediction_bulk = async_view(views.ai_price_prediction_bulk)
+resale_batch = async_view(views.resale_batch)
@@ -0,0 +1,10 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .instrumentation import span
+
+
+# JWT authentication with the token check reported as the 'auth' phase of the request
+class TimedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        with span('auth'):
+            return super().authenticate(request)
@@ -0,0 +1,121 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .coalescing import SingleFlight
+from .dataset import normalise_flat_type
+from .instrumentation import span
+
+# Rendered resale API responses live in this Django cache. Bodies larger than
+# RESALE_RESPONSE_CACHE_MAX_BYTES (unpaged raw data, big search pages) are not stored, so
+# the cache's entry limit also bounds its memory.
+RESPONSE_CACHE_ALIAS = 'responses'
+DEFAULT_MAX_CACHED_BYTES = 256 * 1024
+
+# Query parameters whose values are town names or flat types
+TOWN_LIST_PARAMS = ('towns',)
+FLAT_TYPE_PARAMS = ('room_type', 'flat_type')
+
+
+# Canonical form of the query string: parameters sorted by name, `towns` uppercased and
+# sorted, and flat types uppercased with hyphens read as spaces ("4-room" == "4 ROOM").
+def normalise_query(query):
+    normalised = []
+    for name in sorted(query.keys()):
+        values = query.getlist(name)
+        if name in TOWN_LIST_PARAMS:
+            values = sorted(set(value.strip().upper() for value in values))
+        elif name in FLAT_TYPE_PARAMS:
+            values = [normalise_flat_type(value) for value in values]
+        normalised.append((name, tuple(values)))
+    return tuple(normalised)
+
+
+def max_cached_bytes():
+    return getattr(settings, 'RESALE_RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_CACHED_BYTES)
+
+
+# Identical requests (same key) that miss the cache at the same time are computed once
+response_flights = SingleFlight()
+
+
+# Readable form of the normalised query, used to label coalescing counts
+def query_label(request):
+    params = '&'.join(f"{name}={','.join(values)}" for name, values in normalise_query(request.GET))
+    return f"{request.path}?{params}" if params else request.path
+
+
+def response_cache_key(request, version):
+    raw = repr((version, request.path, normalise_query(request.GET), request.META.get('HTTP_ACCEPT', '')))
+    return 'response:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+# Run the view and render its response. Returns (entry, response); entry holds what the
+# response cache stores, or is None for a streaming response.
+def _render_entry(view, request, args, kwargs):
+    response = view(request, *args, **kwargs)
+    if response.streaming:
+        return None, response
+    if hasattr(response, 'render'):
+        response.render()
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'status': response.status_code,
+        'etag': '"%s"' % hashlib.sha256(response.content).hexdigest()[:32],
+    }, response
+
+
+def _entry_response(entry):
+    return HttpResponse(entry['content'], content_type=entry['content_type'], status=entry.get('status', 200))
+
+
+# Cache the rendered body of successful GET responses (up to the size limit), keyed on the normalised query and
+# the dataset version, and answer conditional requests with 304 Not Modified. On a miss,
+# identical requests already being computed wait for that computation (single flight)
+# and get a copy of its response; a streaming response cannot be shared, so waiters on
+# one run the view themselves.
+# get_version() returns the current dataset version, get_last_modified() its timestamp.
+def cached_response(get_version, get_last_modified=None, alias=RESPONSE_CACHE_ALIAS):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            # outside the cache span: on a cold worker this loads the dataset (its own span)
+            version = get_version()
+
+            cache = caches[alias]
+            with span('cache'):
+                key = response_cache_key(request, version)
+                entry = cache.get(key)
+
+            if entry is None:
+                (entry, response), led = response_flights.do(
+                    key, lambda: _render_entry(view, request, args, kwargs), label=query_label(request), group=request.path,
+                )
+                if entry is None:
+                    return response if led else view(request, *args, **kwargs)
+                if not led:
+                    response = _entry_response(entry)
+                if entry['status'] != 200:
+                    return response
+                if led and len(entry['content']) <= max_cached_bytes():
+                    cache.set(key, entry)
+            else:
+                response = _entry_response(entry)
+
+            last_modified = get_last_modified() if get_last_modified else None
+            response['ETag'] = entry['etag']
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+
+            return get_conditional_response(request, etag=entry['etag'], last_modified=last_modified, response=response)
+        return wrapper
+    return decorator
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Single-flight de-duplication: while func() runs for a key, other callers with the same
+# key wait for it and get its result (or its exception) instead of running it again.
+# Counts how often each key led a computation and how often callers waited on one; per-key
+# counts are kept for the most recent max_tracked_keys keys, per-group totals for all.
+class SingleFlight:
+    def __init__(self, max_tracked_keys=1024):
+        self.max_tracked_keys = max_tracked_keys
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._key_counts = OrderedDict()
+        self._group_counts = {}
+
+    # Returns (result, led): led is True for the caller that ran func
+    def do(self, key, func, label=None, group=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._count(label or key, group, leader)
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = func()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, True
+
+    def _count(self, label, group, leader):
+        role = 0 if leader else 1
+        counts = self._key_counts.pop(label, None) or [0, 0]
+        counts[role] += 1
+        self._key_counts[label] = counts
+        if len(self._key_counts) > self.max_tracked_keys:
+            self._key_counts.popitem(last=False)
+        if group is not None:
+            self._group_counts.setdefault(group, [0, 0])[role] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'groups': {group: {'leads': leads, 'waits': waits} for group, (leads, waits) in self._group_counts.items()},
+                'keys': {label: {'leads': leads, 'waits': waits} for label, (leads, waits) in reversed(self._key_counts.items())},
+            }
@@ -0,0 +1,285 @@
+import numpy as np
+import pandas as pd
+
+from .dataset import match_flat_types, month_labels
+
+# Months per period of each time resolution kept by the cube
+PERIOD_MONTHS = {'month': 1, 'quarter': 3, 'year': 12}
+
+
+# Period index (months, quarters or years since 1970) of month indexes
+def period_index(months, interval):
+    return months // PERIOD_MONTHS[interval]
+
+
+# Key of a period as it appears in summaries: month index, quarter index, or calendar year
+def period_key(index, interval):
+    return index + 1970 if interval == 'year' else index
+
+
+def _period_label_table(index, interval):
+    if interval == 'year':
+        return (index + 1970).astype(str)
+    if interval == 'quarter':
+        return np.array([f"{i // 4 + 1970}-Q{i % 4 + 1}" for i in index.tolist()], dtype=object)
+    return month_labels(index)
+
+
+# Count, sum and sum-of-squares per town x flat_type x period at one time resolution, with
+# every period's label. Covers months first_month..last_month of the cube it was built
+# from; a period only partly inside that range holds the months that are.
+class Rollup:
+    def __init__(self, interval, first_index, count, total, total_sq, labels, first_month, last_month):
+        self.interval = interval
+        self.first_index = first_index
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.labels = labels
+        self.first_month = first_month
+        self.last_month = last_month
+
+    @classmethod
+    def from_months(cls, interval, first_month, count, total, total_sq):
+        months = np.arange(first_month, first_month + count.shape[2])
+        index = period_index(months, interval)
+        boundaries = np.flatnonzero(np.r_[True, index[1:] != index[:-1]]) if len(months) else np.arange(0)
+        if interval != 'month':
+            count, total, total_sq = [
+                np.add.reduceat(values, boundaries, axis=2) if len(months) else values
+                for values in (count, total, total_sq)
+            ]
+        index = index[boundaries]
+        first_index = int(index[0]) if len(index) else period_index(first_month, interval)
+        return cls(
+            interval, first_index, count, total, total_sq, _period_label_table(index, interval),
+            first_month, first_month + len(months) - 1,
+        )
+
+    # Same rollup for a subset of towns and flat types
+    def take(self, town_pos, flat_type_pos):
+        cells = np.ix_(town_pos, flat_type_pos)
+        return Rollup(
+            self.interval, self.first_index, self.count[cells], self.total[cells], self.total_sq[cells],
+            self.labels, self.first_month, self.last_month,
+        )
+
+    @property
+    def keys(self):
+        return period_key(np.arange(self.first_index, self.first_index + self.count.shape[2]), self.interval)
+
+    # Labels ('YYYY-MM', 'YYYY-Qn', 'YYYY') of period keys
+    def label(self, keys):
+        index = np.asarray(keys, dtype=np.int64) - (1970 if self.interval == 'year' else 0)
+        return self.labels[index - self.first_index]
+
+
+# Count, sum and sum-of-squares of resale prices for every town x flat_type x month cell.
+# Sums are taken around a fixed shift (the overall mean price) so that the variance
+# derived from them does not lose precision to cancellation. Quarterly and yearly rollups
+# are built with the cube, so coarser summaries read whole periods instead of months.
+class AggregateCube:
+    def __init__(self, towns, flat_types, first_month, count, total, total_sq, shift, rollups=None):
+        self.towns = towns
+        self.flat_types = flat_types
+        self.first_month = first_month
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.shift = shift
+
+        if rollups is None:
+            rollups = {
+                interval: Rollup.from_months(interval, first_month, count, total, total_sq)
+                for interval in PERIOD_MONTHS if interval != 'month'
+            }
+        self.rollups = {'month': Rollup.from_months('month', first_month, count, total, total_sq), **rollups}
+
+    # Build the cube from the cleaned frame in a single pass over the rows
+    @classmethod
+    def from_frame(cls, df):
+        towns = np.asarray(df['town'].cat.categories, dtype=object)
+        flat_types = np.asarray(df['flat_type'].cat.categories, dtype=object)
+        months = df['month'].to_numpy()
+        prices = df['resale_price'].to_numpy(dtype=np.float64)
+
+        if len(df):
+            first_month, last_month = int(months.min()), int(months.max())
+            shift = float(prices.mean())
+        else:
+            first_month, last_month, shift = 0, -1, 0.0
+
+        shape = (len(towns), len(flat_types), last_month - first_month + 1)
+        cells = np.ravel_multi_index(
+            (df['town'].cat.codes.to_numpy(), df['flat_type'].cat.codes.to_numpy(), months - first_month),
+            shape,
+        )
+        size = int(np.prod(shape))
+        centred = prices - shift
+
+        count = np.bincount(cells, minlength=size).reshape(shape)
+        total = np.bincount(cells, weights=centred, minlength=size).reshape(shape)
+        total_sq = np.bincount(cells, weights=centred * centred, minlength=size).reshape(shape)
+        return cls(towns, flat_types, first_month, count, total, total_sq, shift)
+
+    # New cube with the given typed rows added; only their cells are touched. The axes grow
+    # when the rows bring new towns, flat types or months. The shift is kept, as any fixed
+    # shift gives exact totals.
+    def with_rows(self, rows):
+        towns = pd.Index(self.towns).union(pd.Index(rows['town'].astype(object).unique()))
+        flat_types = pd.Index(self.flat_types).union(pd.Index(rows['flat_type'].astype(object).unique()))
+        months = rows['month'].to_numpy()
+        first_month = min(self.first_month, int(months.min())) if self.count.size else int(months.min())
+        last_month = max(self.last_month, int(months.max())) if self.count.size else int(months.max())
+
+        shape = (len(towns), len(flat_types), last_month - first_month + 1)
+        old_cells = np.ix_(
+            towns.get_indexer(self.towns),
+            flat_types.get_indexer(self.flat_types),
+            np.arange(self.first_month, self.last_month + 1) - first_month,
+        )
+        new_cells = (
+            towns.get_indexer(rows['town'].astype(object)),
+            flat_types.get_indexer(rows['flat_type'].astype(object)),
+            months - first_month,
+        )
+        centred = rows['resale_price'].to_numpy(dtype=np.float64) - self.shift
+
+        arrays = []
+        for old, increment in ((self.count, 1), (self.total, centred), (self.total_sq, centred * centred)):
+            values = np.zeros(shape, dtype=old.dtype)
+            values[old_cells] = old
+            np.add.at(values, new_cells, increment)
+            arrays.append(values)
+
+        return AggregateCube(
+            np.asarray(towns, dtype=object), np.asarray(flat_types, dtype=object), first_month, *arrays, self.shift
+        )
+
+    @property
+    def last_month(self):
+        return self.first_month + self.count.shape[2] - 1
+
+    # Positions of the given labels on an axis, in label order (unknown labels are dropped)
+    @staticmethod
+    def _positions(axis_labels, labels):
+        positions = pd.Index(axis_labels).get_indexer(labels)
+        return np.unique(positions[positions >= 0])
+
+    def town_positions(self, labels):
+        return self._positions(self.towns, labels)
+
+    # Flat types are matched like query values ("4-room" finds "4 ROOM")
+    def flat_type_positions(self, labels):
+        return self._positions(self.flat_types, match_flat_types(self.flat_types, labels))
+
+    # Per-year transaction counts and (uncentred) price sums for every town x flat_type
+    def yearly_totals(self):
+        years = self.rollups['year']
+        return years.keys, years.count, years.total + self.shift * years.count
+
+    # Counts and sums of the selected towns and flat types per period of the interval over
+    # months start..end. Whole periods come from the rollup; a period the range only partly
+    # covers (at either end) is summed from its months.
+    def _period_sums(self, interval, town_pos, flat_type_pos, start, end):
+        rollup = self.rollups[interval]
+        size = PERIOD_MONTHS[interval]
+        first, last = start // size, end // size
+
+        positions = np.arange(first, last + 1) - rollup.first_index
+        cells = np.ix_(town_pos, flat_type_pos, positions)
+        arrays = [values[cells] for values in (rollup.count, rollup.total, rollup.total_sq)]
+
+        for period in {first, last}:
+            covered = max(start, period * size), min(end, period * size + size - 1)
+            if covered != (max(rollup.first_month, period * size), min(rollup.last_month, period * size + size - 1)):
+                months = np.ix_(town_pos, flat_type_pos, np.arange(covered[0], covered[1] + 1) - self.first_month)
+                for values, monthly in zip(arrays, (self.count, self.total, self.total_sq)):
+                    values[:, :, period - first] = monthly[months].sum(axis=2)
+
+        return period_key(np.arange(first, last + 1), interval), arrays
+
+    # Labels of period keys from a summary column ('YYYY-MM', 'YYYY-Qn' or 'YYYY')
+    def period_labels(self, keys, interval):
+        return self.rollups[interval].label(keys)
+
+    # Sub-cube of the given town/flat_type positions and inclusive month range
+    def window(self, towns=None, flat_types=None, start=None, end=None):
+        start = self.first_month if start is None else max(start, self.first_month)
+        end = self.last_month if end is None else min(end, self.last_month)
+        town_pos = np.arange(len(self.towns)) if towns is None else towns
+        flat_type_pos = np.arange(len(self.flat_types)) if flat_types is None else flat_types
+
+        cells = np.ix_(town_pos, flat_type_pos, np.arange(start, max(start, end + 1)) - self.first_month)
+        rollups = {
+            interval: rollup.take(town_pos, flat_type_pos)
+            for interval, rollup in self.rollups.items() if interval != 'month'
+        }
+        return AggregateCube(
+            self.towns[town_pos], self.flat_types[flat_type_pos], start,
+            self.count[cells], self.total[cells], self.total_sq[cells], self.shift, rollups,
+        )
+
+    # Aggregate the selected cells, grouped by any of 'town', 'flat_type' and one of 'month',
+    # 'quarter', 'year' (in the given order). Returns one row per non-empty group with count, mean and the
+    # sample standard deviation, matching pandas groupby mean()/std().
+    def summarise(self, by, towns=None, flat_types=None, start=None, end=None):
+        start = self.first_month if start is None else max(start, self.first_month)
+        end = self.last_month if end is None else min(end, self.last_month)
+        town_pos = np.arange(len(self.towns)) if towns is None else towns
+        flat_type_pos = np.arange(len(self.flat_types)) if flat_types is None else flat_types
+
+        columns = list(by) + ['count', 'mean', 'std']
+        if start > end or not len(town_pos) or not len(flat_type_pos):
+            return pd.DataFrame(columns=columns)
+
+        # Read the grouped resolution (years when no period is grouped on, as it is summed out)
+        period = next((name for name in by if name in PERIOD_MONTHS), 'year')
+        period_keys, arrays = self._period_sums(period, town_pos, flat_type_pos, start, end)
+
+        axis_names = ['town', 'flat_type', period]
+        axis_keys = [self.towns[town_pos], self.flat_types[flat_type_pos], period_keys]
+
+        # Sum out every axis that is not grouped on, then order the remaining axes like `by`
+        summed = tuple(axis for axis, name in enumerate(axis_names) if name not in by)
+        arrays = [values.sum(axis=summed) for values in arrays]
+        kept = [name for name in axis_names if name in by]
+        order = [kept.index(name) for name in by]
+        count, total, total_sq = [np.transpose(values, order) for values in arrays]
+
+        keys = dict(zip(axis_names, axis_keys))
+        grid = np.indices(count.shape).reshape(len(by), -1)
+        count, total, total_sq = count.ravel(), total.ravel(), total_sq.ravel()
+        present = count > 0
+
+        n = count[present].astype(np.float64)
+        mean_offset = total[present] / n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (total_sq[present] - total[present] * mean_offset) / (n - 1)
+        std = np.where(n > 1, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+        result = {name: keys[name][index[present]] for name, index in zip(by, grid)}
+        result['count'] = count[present]
+        result['mean'] = mean_offset + self.shift
+        result['std'] = std
+        return pd.DataFrame(result, columns=columns)
+
+
+# Windows of a cube taken for a set of queries: queries over the same towns and months
+# share one window instead of each indexing the full cube
+class CubeSlices:
+    def __init__(self, cube):
+        self.cube = cube
+        self._windows = {}
+
+    def window(self, town_labels, start=None, end=None):
+        key = (tuple(sorted(set(town_labels))), start, end)
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = self.cube.window(self.cube.town_positions(key[0]), start=start, end=end)
+        return window
+
+
+# Inclusive month-index range for a [start_year, end_year] filter
+def year_range(start_year, end_year):
+    return (int(start_year) - 1970) * 12, (int(end_year) - 1970) * 12 + 11
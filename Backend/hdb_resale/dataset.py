@@ -0,0 +1,389 @@
+import hashlib
+import io
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Location of the source CSV and the prebuilt binary snapshot
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+DATA_FILE = os.path.join(DATA_DIR, "hdb_resale_prices_data.csv")
+SNAPSHOT_FILE = os.path.join(DATA_DIR, "hdb_resale_prices_data.npz")
+
+# Bump whenever the snapshot or shared-directory layout or the cleaning steps change
+SNAPSHOT_VERSION = 6
+
+# Text columns kept as pandas Categoricals (int codes plus a sorted lookup table). They are
+# text even when a file holds only numbers in them (e.g. no lettered blocks yet), so a later
+# "123A" is one more label rather than a failed integer cast.
+CATEGORICAL_COLUMNS = ['town', 'flat_type', 'block', 'street_name', 'storey_range', 'flat_model', 'remaining_lease']
+
+
+# Content hash of the source CSV, read in chunks so large files stay cheap on memory
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Content hashes of the first `size` bytes of a file for each of the (increasing) sizes,
+# in one read. A file that only had bytes appended still has its old digest as a prefix.
+def prefix_digests(path, sizes, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    digests = []
+    position = 0
+    with open(path, 'rb') as handle:
+        for size in sizes:
+            while position < size:
+                chunk = handle.read(min(chunk_size, size - position))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                position += len(chunk)
+            digests.append(digest.hexdigest())
+    return digests
+
+
+# Months since 1970-01 for a datetime64 array (or anything numpy can cast to datetime64[M])
+def to_month_index(values):
+    return np.asarray(values, dtype='datetime64[M]').astype(np.int32)
+
+
+# 'YYYY-MM' labels for an array of month indexes
+def month_labels(month_index):
+    return np.datetime_as_string(np.asarray(month_index).astype('datetime64[M]'), unit='M')
+
+
+# Inclusive [start, end] month-index range covering the same rows as
+# `start_date <= month <= end_date` on first-of-month timestamps
+def month_range(start_date, end_date):
+    start = int(to_month_index(start_date.to_datetime64()))
+    if start_date > pd.Timestamp(start_date.year, start_date.month, 1):
+        start += 1
+    end = int(to_month_index(end_date.to_datetime64()))
+    return start, end
+
+
+# Flat type of a query uppercased, with hyphens read as spaces ("4-room" == "4 ROOM")
+def normalise_flat_type(value):
+    return value.upper().strip().replace("-", " ")
+
+
+# Category labels matching the given query flat types. Both sides are compared in
+# normalised form, so "4-room" finds "4 ROOM" and "Multi-Generation" "MULTI-GENERATION".
+def match_flat_types(categories, values):
+    lookup = {normalise_flat_type(str(label)): label for label in categories}
+    return [lookup[key] for key in (normalise_flat_type(value) for value in values) if key in lookup]
+
+
+# Codes of the given labels in a categorical column (labels that are not present are dropped)
+def category_codes(column, labels):
+    categories = column.cat.categories
+    codes = categories.get_indexer(labels)
+    return codes[codes >= 0]
+
+
+# Type the columns of already de-duplicated raw rows, keeping their index. Rows whose
+# month or price does not parse are dropped: they have no place in the month index, and a
+# NaN price would turn every total it is added to into NaN.
+def type_resale_columns(df):
+    df = df.copy()
+    df['resale_price'] = pd.to_numeric(df['resale_price'], errors='coerce')
+    month = pd.to_datetime(df['month'], errors='coerce')
+    parsed = month.notna() & df['resale_price'].notna()
+    df, month = df[parsed], month[parsed]
+    df['month'] = to_month_index(month.to_numpy())
+    df['year'] = month.dt.year.astype(np.int16)
+    df['town'] = df['town'].str.upper()
+    df['flat_type'] = df['flat_type'].str.upper()
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(str).astype('category')
+    return df
+
+
+# Clean and type the raw resale transactions. Text columns become Categoricals and month
+# becomes an int32 month index, so filters run as integer comparisons. Rows are stored
+# sorted by (town, month), keeping file order within a month, so every town and month
+# range is one contiguous block of rows.
+def clean_resale_data(df):
+    df = df.dropna()
+    df = df.drop_duplicates().reset_index(drop=True)
+    df = type_resale_columns(df)
+    return df.sort_values(['town', 'month'], kind='stable').reset_index(drop=True)
+
+
+# Parse and clean the source CSV (slow path)
+def read_resale_csv(path=DATA_FILE):
+    return clean_resale_data(pd.read_csv(path))
+
+
+# Typed column arrays of the cleaned frame. Categoricals are stored as their codes
+# plus the category lookup table.
+def frame_to_arrays(df):
+    arrays = {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays['col_' + column] = values.cat.codes.to_numpy()
+            arrays['uniq_' + column] = np.asarray(values.cat.categories, dtype=str)
+        else:
+            arrays['col_' + column] = values.to_numpy()
+    arrays['meta_columns'] = np.array(df.columns, dtype=str)
+    return arrays
+
+
+# Rebuild the frame from frame_to_arrays() output without copying the column arrays
+def arrays_to_frame(arrays):
+    columns = arrays['meta_columns'].tolist()
+    data = {}
+    for column in columns:
+        values = arrays['col_' + column]
+        if 'uniq_' + column in arrays:
+            categories = arrays['uniq_' + column].astype(object)
+            values = pd.Categorical.from_codes(values, categories=categories)
+        data[column] = values
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+# Write the cleaned frame as an .npz of typed column arrays, tagged with the source hash
+def write_snapshot(df, source_path=DATA_FILE, snapshot_path=SNAPSHOT_FILE):
+    stat = os.stat(source_path)
+    arrays = frame_to_arrays(df)
+    arrays['meta_version'] = np.array(SNAPSHOT_VERSION)
+    arrays['meta_source_hash'] = np.array(file_digest(source_path))
+    arrays['meta_source_size'] = np.array(stat.st_size)
+    arrays['meta_source_mtime'] = np.array(stat.st_mtime_ns)
+
+    # Write to a temporary file first so readers never see a half-written snapshot
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'wb') as handle:
+        np.savez(handle, **arrays)
+    os.replace(tmp_path, snapshot_path)
+
+
+# Check the snapshot against the source CSV. Size and mtime are compared first, the
+# content hash is only computed when they differ (e.g. after a fresh checkout).
+def snapshot_is_fresh(snapshot, source_path=DATA_FILE):
+    if int(snapshot['meta_version']) != SNAPSHOT_VERSION:
+        return False
+
+    stat = os.stat(source_path)
+    if stat.st_size != int(snapshot['meta_source_size']):
+        return False
+    if stat.st_mtime_ns == int(snapshot['meta_source_mtime']):
+        return True
+
+    return file_digest(source_path) == str(snapshot['meta_source_hash'])
+
+
+# Row offsets of each town in a frame sorted by (town, month). A town's rows are
+# offsets[code]:offsets[code + 1], and month ranges inside it are found by binary search.
+class TownIndex:
+    def __init__(self, df):
+        town_codes = df['town'].cat.codes.to_numpy()
+        self.months = df['month'].to_numpy()
+        self.offsets = np.searchsorted(town_codes, np.arange(len(df['town'].cat.categories) + 1))
+
+    # Slice of the rows for one town code, optionally limited to an inclusive month range
+    def rows(self, code, start=None, end=None):
+        lo, hi = int(self.offsets[code]), int(self.offsets[code + 1])
+        months = self.months[lo:hi]
+        first = lo if start is None else lo + int(np.searchsorted(months, start, side='left'))
+        last = hi if end is None else lo + int(np.searchsorted(months, end, side='right'))
+        return slice(first, max(first, last))
+
+    # Row offsets of several (town code, first month, last month) ranges, concatenated
+    def range_rows(self, codes, starts, ends):
+        ranges = [self.rows(code, start, end) for code, start, end in zip(codes, starts, ends)]
+        return np.concatenate([np.arange(rows.start, rows.stop) for rows in ranges]) if ranges else np.arange(0)
+
+
+# Clean a delta of raw rows and drop those already in the dataset. Duplicates are only
+# looked for among existing rows of the towns and months the delta touches, found through
+# the town index. Returns the surviving raw rows and their typed form (same index).
+def new_resale_rows(df, town_index, delta):
+    raw = delta.dropna().drop_duplicates()
+    typed = type_resale_columns(raw)
+    raw = raw.loc[typed.index]
+    if typed.empty:
+        return raw, typed
+
+    # Bring both sides to a common dtype (e.g. float for a whole-number column of the file
+    # and fractional delta values) so equal rows hash equally
+    dtypes = {}
+    for column in df.columns:
+        if not isinstance(df[column].dtype, pd.CategoricalDtype):
+            dtypes[column] = np.result_type(df[column].dtype, typed[column].dtype)
+    typed = typed.astype(dtypes)
+
+    categories = df['town'].cat.categories
+    existing = []
+    for town, months in typed.groupby('town', observed=True)['month']:
+        code = categories.get_loc(town) if town in categories else None
+        if code is not None:
+            existing.append(df.iloc[town_index.rows(code, int(months.min()), int(months.max()))])
+
+    if existing:
+        existing_hashes = pd.util.hash_pandas_object(pd.concat(existing)[df.columns].astype(dtypes), index=False)
+        fresh = ~pd.util.hash_pandas_object(typed[df.columns], index=False).isin(existing_hashes)
+        raw, typed = raw[fresh.to_numpy()], typed[fresh.to_numpy()]
+    return raw, typed
+
+
+# Insert typed new rows into a frame sorted by (town, month). Category lookup tables are
+# widened (and existing codes remapped) only when the new rows bring unseen values, and
+# other columns are widened to a dtype that holds both sides.
+# Returns the new frame and the (sorted) offsets of the inserted rows in it.
+def append_resale_rows(df, rows):
+    if rows.empty:
+        return df, np.arange(0)
+
+    data = {}
+    for column in df.columns:
+        values, new_values = df[column], rows[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = values.cat.categories.union(pd.Index(new_values.astype(object).unique()))
+            codes = values.cat.codes.to_numpy().astype(np.int32)
+            if len(categories) != len(values.cat.categories):
+                codes = categories.get_indexer(values.cat.categories)[codes]
+            new_codes = categories.get_indexer(new_values.astype(object))
+            data[column] = (codes, new_codes, categories)
+        else:
+            dtype = np.result_type(values.dtype, new_values.dtype)
+            data[column] = (values.to_numpy(dtype=dtype), new_values.to_numpy(dtype=dtype), None)
+
+    # New rows go after existing rows of the same (town, month), like appended file rows
+    town_codes, new_town_codes = data['town'][0], data['town'][1]
+    keys = (town_codes.astype(np.int64) << 32) | data['month'][0].astype(np.int64)
+    new_keys = (new_town_codes.astype(np.int64) << 32) | data['month'][1].astype(np.int64)
+    order = np.argsort(new_keys, kind='stable')
+    positions = np.searchsorted(keys, new_keys[order], side='right')
+
+    merged = {}
+    for column, (values, new_values, categories) in data.items():
+        combined = np.insert(values, positions, new_values[order])
+        if categories is not None:
+            combined = pd.Categorical.from_codes(combined, categories=categories)
+        merged[column] = combined
+    return pd.DataFrame(merged, columns=df.columns, copy=False), positions + np.arange(len(positions))
+
+
+# Append raw rows to the data file, in the file's column order
+def append_to_csv(rows, path=DATA_FILE):
+    header = pd.read_csv(path, nrows=0).columns
+    with open(path, 'rb+') as handle:
+        handle.seek(0, os.SEEK_END)
+        if handle.tell():
+            handle.seek(-1, os.SEEK_END)
+            if handle.read(1) != b'\n':
+                handle.write(b'\n')
+    rows[header].to_csv(path, mode='a', header=False, index=False)
+
+
+# Raw rows appended to a data file between byte offsets start and end, with the file's
+# columns. Only complete lines are read (a writer may still be appending); also returns
+# the offset just past the last line read.
+def read_appended_rows(start, end, path=DATA_FILE):
+    header = pd.read_csv(path, nrows=0).columns
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        data = handle.read(end - start)
+    data = data[:data.rfind(b'\n') + 1]
+    if not data.strip():
+        return pd.DataFrame(columns=header), start + len(data)
+    return pd.read_csv(io.BytesIO(data), header=None, names=header), start + len(data)
+
+
+# Load the snapshot if it exists and matches the source CSV, otherwise return None.
+# Returns the frame and the content hash of the CSV it was built from.
+def read_snapshot(snapshot_path=SNAPSHOT_FILE, source_path=DATA_FILE):
+    if not os.path.exists(snapshot_path):
+        return None
+
+    try:
+        with np.load(snapshot_path, allow_pickle=False) as snapshot:
+            if not snapshot_is_fresh(snapshot, source_path):
+                return None
+            source_hash = str(snapshot['meta_source_hash'])
+            df = arrays_to_frame({name: snapshot[name] for name in snapshot.files})
+    except (OSError, KeyError, ValueError):
+        return None
+
+    return df, source_hash
+
+
+# Shared-memory mode: the column arrays of one dataset version are written once as .npy
+# files under shared_dir/<version>/ (ideally on tmpfs such as /dev/shm) and every worker
+# memory-maps them read-only, so the transaction columns exist once per host instead of
+# once per worker. A file lock makes sure only one process builds each version.
+# derived(df), when given, returns further named arrays built from the frame (per-row
+# indexes); they are written and mapped alongside the columns and returned as well.
+def write_shared_arrays(df, directory, derived=None):
+    tmp_directory = directory + '.tmp'
+    shutil.rmtree(tmp_directory, ignore_errors=True)
+    os.makedirs(tmp_directory)
+    arrays = frame_to_arrays(df)
+    if derived is not None:
+        arrays.update(derived(df))
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_directory, name + '.npy'), values, allow_pickle=False)
+    os.replace(tmp_directory, directory)
+
+
+# The frame and every array (columns and derived) of a shared version, memory-mapped
+def read_shared_arrays(directory):
+    arrays = {}
+    for filename in os.listdir(directory):
+        name, extension = os.path.splitext(filename)
+        if extension == '.npy':
+            arrays[name] = np.load(os.path.join(directory, filename), mmap_mode='r', allow_pickle=False)
+    return arrays_to_frame(arrays), arrays
+
+
+# Returns the frame, the dataset version and the mapped arrays
+def load_shared_dataset(shared_dir, source_path=DATA_FILE, snapshot_path=SNAPSHOT_FILE, derived=None):
+    # POSIX only, like the shared mode itself; imported here so the module loads on Windows
+    import fcntl
+
+    if not os.path.exists(source_path):
+        raise FileNotFoundError("Data file not found. Ensure 'hdb_resale_prices_data.csv' is available.")
+
+    os.makedirs(shared_dir, exist_ok=True)
+    version = file_digest(source_path)
+    directory = os.path.join(shared_dir, f"v{SNAPSHOT_VERSION}-{version}")
+
+    if not os.path.isdir(directory):
+        with open(os.path.join(shared_dir, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another worker may have built it while we waited for the lock
+                if not os.path.isdir(directory):
+                    df, _ = load_dataset(source_path, snapshot_path)
+                    write_shared_arrays(df, directory, derived)
+                    # Drop older versions; workers still mapping them keep their pages
+                    for name in os.listdir(shared_dir):
+                        path = os.path.join(shared_dir, name)
+                        if path != directory and os.path.isdir(path):
+                            shutil.rmtree(path, ignore_errors=True)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    df, arrays = read_shared_arrays(directory)
+    return df, version, arrays
+
+
+# Load the cleaned dataset, preferring a fresh snapshot over re-parsing the CSV.
+# Returns the frame and a dataset version (the content hash of the source CSV).
+def load_dataset(source_path=DATA_FILE, snapshot_path=SNAPSHOT_FILE):
+    if not os.path.exists(source_path):
+        raise FileNotFoundError("Data file not found. Ensure 'hdb_resale_prices_data.csv' is available.")
+
+    loaded = read_snapshot(snapshot_path, source_path)
+    if loaded is None:
+        loaded = read_resale_csv(source_path), file_digest(source_path)
+    return loaded
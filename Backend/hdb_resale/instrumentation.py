@@ -0,0 +1,124 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Phase timings of the request being handled: list of (name, seconds), or None outside a request
+_request_spans = contextvars.ContextVar('resale_request_spans', default=None)
+
+
+# Cumulative Prometheus-style histogram with one series per label value
+class Histogram:
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((value, [list(counts), total, count]) for value, (counts, total, count) in self._series.items())
+        for value, (counts, total, count) in series:
+            labels = f'{self.label}="{value}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return '\n'.join(lines)
+
+
+request_seconds = Histogram('resale_request_seconds', "Request latency by view.", 'view')
+span_seconds = Histogram('resale_span_seconds', "Time spent in each request phase.", 'span')
+
+
+# Time a phase of request handling: recorded in the span histogram and, inside a request,
+# reported in that response's Server-Timing header
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        span_seconds.observe(name, elapsed)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, elapsed))
+
+
+# Server-Timing header value: one entry per phase (repeated phases are summed), plus total
+def server_timing_header(spans, total):
+    durations = {}
+    for name, seconds in spans:
+        durations[name] = durations.get(name, 0.0) + seconds
+    entries = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in durations.items()]
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ', '.join(entries)
+
+
+# Records per-view latency and phase spans, and adds a Server-Timing header to responses
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        return self._finish(request, response, spans, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        spans = []
+        token = _request_spans.set(spans)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_spans.reset(token)
+        return self._finish(request, response, spans, time.perf_counter() - start)
+
+    def _finish(self, request, response, spans, total):
+        match = request.resolver_match
+        request_seconds.observe(match.view_name if match else 'unresolved', total)
+        response['Server-Timing'] = server_timing_header(spans, total)
+        return response
+
+
+def render_metrics(extra_lines=()):
+    return '\n'.join([request_seconds.render(), span_seconds.render(), *extra_lines]) + '\n'
@@ -0,0 +1,46 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from hdb_resale.renderers import Columns, ResaleJSONRenderer, ColumnarJSONRenderer
+from hdb_resale.registry import registry
+import pandas as pd
+
+
+# Compare encode time and payload size of the records and columnar response formats
+class Command(BaseCommand):
+    help = "Benchmark JSON encoding of a comparison_graph result (5 towns, month interval)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50, help="Encodes per format.")
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        cube = registry.current().cube
+        towns = cube.towns[:5].tolist()
+
+        summary = cube.summarise(['month', 'town'], towns=cube.town_positions(towns))
+        grouped = pd.DataFrame({
+            'date': cube.period_labels(summary['month'], 'month'),
+            'town': summary['town'],
+            'avg_price': summary['mean'],
+        })
+
+        formats = {
+            'records (to_dict + JSONRenderer)': lambda: JSONRenderer().render(grouped.to_dict(orient='records')),
+            'records (ResaleJSONRenderer)': lambda: ResaleJSONRenderer().render(Columns.from_frame(grouped)),
+            'columnar (ColumnarJSONRenderer)': lambda: ColumnarJSONRenderer().render(Columns.from_frame(grouped)),
+        }
+
+        results = {'towns': towns, 'rows': len(grouped), 'repeat': repeat, 'formats': {}}
+        for name, encode in formats.items():
+            payload = encode()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                encode()
+            elapsed = (time.perf_counter() - start) / repeat
+            results['formats'][name] = {'encode_ms': round(elapsed * 1000, 3), 'bytes': len(payload)}
+
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,216 @@
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import setup_test_environment
+
+from hdb_resale.ai_prediction import FORECAST_CACHE_ALIAS
+from hdb_resale.caching import RESPONSE_CACHE_ALIAS
+from hdb_resale.dataset import load_dataset, write_snapshot
+from hdb_resale.registry import ResaleDataset, registry
+from hdb_resale.synthetic import synthetic_resale_frame
+
+API = '/api/resale/'
+
+# Views whose work is mostly forecasts; they are measured with a cold forecast cache and
+# again with a warm one
+FORECAST_VIEWS = ('ai_predict', 'ai_predict_bulk', 'batch')
+
+
+# Resident set size of this process in bytes (current, and peak so far)
+def memory_usage():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open('/proc/self/statm') as statm:
+            current = int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        current = None
+    return {'rss_bytes': current, 'peak_rss_bytes': peak}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# One randomised query per call for each resale endpoint: a path for a GET, or a
+# (path, JSON body) pair for a POST. addresses are (town, block, street_name) triples.
+def query_factories(towns, years, addresses):
+    def pick_towns(rng, count=5):
+        return '&'.join('towns=' + town for town in rng.choice(towns, count, replace=False))
+
+    def year_span(rng):
+        start = int(rng.integers(years[0], years[-1]))
+        return start, int(rng.integers(start, years[-1] + 1))
+
+    def month_span(rng):
+        start, end = year_span(rng)
+        return f"start_year={start}-01&end_year={end}-12"
+
+    def pick_address(rng):
+        return addresses[rng.integers(len(addresses))]
+
+    # a street name and the start of a block number, as typed into the search box
+    def search_text(rng):
+        town, block, street_name = pick_address(rng)
+        return f"{street_name.lower()} {block[:-1] or block}"
+
+    def batch(rng):
+        towns_span = {'towns': rng.choice(towns, 5, replace=False).tolist()}
+        start, end = year_span(rng)
+        towns_span.update(start_year=f"{start}-01", end_year=f"{end}-12")
+        return 'batch/', {'queries': [
+            {'query': 'resale_comparison', 'params': towns_span},
+            {'query': 'comparison_graph', 'params': dict(towns_span, interval='year')},
+            {'query': 'resale_trends', 'params': towns_span},
+            {'query': 'ai_predict', 'params': {'town': str(rng.choice(towns))}},
+        ]}
+
+    return {
+        'towns': lambda rng: 'towns/',
+        'years': lambda rng: 'years/',
+        'resale_analysis': lambda rng: 'resale_analysis/?%s&type=%s&start_year=%d&end_year=%d' % (
+            (pick_towns(rng), rng.choice(['price_trends', 'volatility'])) + year_span(rng)),
+        'resale_roomtype_trends': lambda rng: 'resale_roomtype_trends/?town=%s&start_year=%d&end_year=%d' % (
+            (rng.choice(towns),) + year_span(rng)),
+        'resale_comparison': lambda rng: f"resale_comparison/?{pick_towns(rng)}&{month_span(rng)}",
+        'comparison_graph': lambda rng: f"comparison_graph/?{pick_towns(rng)}&{month_span(rng)}&interval={rng.choice(['month', 'year'])}",
+        'trends': lambda rng: f"trends/?{pick_towns(rng)}&{month_span(rng)}&window={rng.choice([3, 12, 24])}",
+        'raw_data_by_town': lambda rng: f"raw_data_by_town/?town={rng.choice(towns)}&limit=500",
+        'ai_predict': lambda rng: f"ai_predict/?town={rng.choice(towns)}",
+        'ai_predict_bulk': lambda rng: 'ai_predict_bulk/',
+        'search': lambda rng: 'search/?' + urlencode({'q': search_text(rng), 'limit': 50}),
+        'search_fuzzy': lambda rng: 'search/?' + urlencode({'q': search_text(rng), 'limit': 50, 'fuzzy': 'true'}),
+        'block_history': lambda rng: 'block_history/?' + urlencode(dict(zip(('town', 'block', 'street_name'), pick_address(rng)))),
+        'batch': batch,
+    }
+
+
+def send(client, request):
+    if isinstance(request, tuple):
+        path, body = request
+        return client.post(API + path, body, content_type='application/json')
+    return client.get(API + request)
+
+
+def latency_stats(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+        'throughput_rps': float(len(latencies) / latencies.sum() * 1000),
+    }
+
+
+# Latency percentiles and throughput for the resale API on synthetic datasets of given sizes
+class Command(BaseCommand):
+    help = "Benchmark dataset load time, memory and per-view latency on synthetic resale data (JSON output)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000], help="Dataset sizes, e.g. 1000000 5000000 20000000.")
+        parser.add_argument('--requests', type=int, default=200, help="Requests per view.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--views', nargs='+', help="Only benchmark these views.")
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        report = {
+            'commit': git_commit(),
+            'requests_per_view': options['requests'],
+            'seed': options['seed'],
+            'datasets': [],
+        }
+
+        previous = registry.peek()
+        try:
+            for rows in options['rows']:
+                report['datasets'].append(self.benchmark_size(rows, options))
+        finally:
+            if previous is not None:
+                registry.swap(previous)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def benchmark_size(self, rows, options):
+        result = {'rows': rows}
+
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'resale.csv')
+            snapshot = os.path.join(directory, 'resale.npz')
+
+            synthetic_resale_frame(rows, seed=options['seed']).to_csv(source, index=False)
+            result['csv_bytes'] = os.path.getsize(source)
+
+            start = time.perf_counter()
+            df, version = load_dataset(source, snapshot)
+            result['load_csv_seconds'] = time.perf_counter() - start
+
+            write_snapshot(df, source, snapshot)
+            del df
+            start = time.perf_counter()
+            df, version = load_dataset(source, snapshot)
+            result['load_snapshot_seconds'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            dataset = ResaleDataset(df, version, os.path.getmtime(source))
+            result['build_indexes_seconds'] = time.perf_counter() - start
+
+        result['frame_bytes'] = int(df.memory_usage(deep=True).sum())
+        result['memory'] = memory_usage()
+        registry.swap(dataset)
+
+        client = Client()
+        rng = np.random.default_rng(options['seed'])
+        towns = dataset.cube.towns.tolist()
+        years = sorted(df['year'].unique().tolist())
+        sample = df[['town', 'block', 'street_name']].iloc[rng.integers(0, len(df), 1000)].astype(str)
+        factories = query_factories(towns, years, list(sample.itertuples(index=False, name=None)))
+
+        result['views'] = {}
+        for name, factory in factories.items():
+            if options['views'] and name not in options['views']:
+                continue
+
+            result['views'][name] = self.measure(client, factory, rng, options['requests'], warm_forecasts=False)
+            if name in FORECAST_VIEWS:
+                result['views'][name]['warm_forecasts'] = self.measure(
+                    client, factory, rng, options['requests'], warm_forecasts=True,
+                )
+
+        return result
+
+    # Latencies of `count` requests from the factory. The response cache is cleared before
+    # each one so the computation is measured, and the forecast cache too unless warm_forecasts.
+    def measure(self, client, factory, rng, count, warm_forecasts):
+        latencies = []
+        for _ in range(count):
+            request = factory(rng)
+            caches[RESPONSE_CACHE_ALIAS].clear()
+            if not warm_forecasts:
+                caches[FORECAST_CACHE_ALIAS].clear()
+            start = time.perf_counter()
+            response = send(client, request)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 500:
+                raise RuntimeError(f"{request} returned {response.status_code}")
+        return latency_stats(latencies)
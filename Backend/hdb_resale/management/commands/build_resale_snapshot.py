@@ -0,0 +1,38 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hdb_resale.dataset import DATA_FILE, SNAPSHOT_FILE, read_resale_csv, read_snapshot, write_snapshot
+
+
+# Build the cleaned binary snapshot that views load instead of parsing the CSV
+class Command(BaseCommand):
+    help = "Parse and clean the resale CSV once and write a typed binary snapshot next to it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=DATA_FILE, help="Path to the resale CSV.")
+        parser.add_argument('--output', default=SNAPSHOT_FILE, help="Path of the snapshot to write.")
+
+    def handle(self, *args, **options):
+        source = options['source']
+        output = options['output']
+
+        if not os.path.exists(source):
+            raise CommandError(f"Data file not found: {source}")
+
+        start = time.perf_counter()
+        df = read_resale_csv(source)
+        csv_seconds = time.perf_counter() - start
+
+        write_snapshot(df, source, output)
+
+        start = time.perf_counter()
+        snapshot = read_snapshot(output, source)
+        snapshot_seconds = time.perf_counter() - start
+
+        if snapshot is None:
+            raise CommandError("Snapshot was written but could not be read back.")
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(df)} rows to {output}"))
+        self.stdout.write(f"CSV load: {csv_seconds:.3f}s, snapshot load: {snapshot_seconds:.3f}s")
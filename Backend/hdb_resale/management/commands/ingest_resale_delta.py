@@ -0,0 +1,36 @@
+import os
+import time
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from hdb_resale.registry import registry
+
+
+# Append a month (or any batch) of new transactions to the data file and snapshot. This
+# process loads the current dataset (from the snapshot) to de-duplicate against it, so
+# each run still costs one load of the history; running workers with
+# RESALE_DATASET_WATCH_INTERVAL set then add only the appended rows (DatasetRegistry.refresh)
+# instead of rebuilding.
+class Command(BaseCommand):
+    help = "Add the new rows of a delta CSV to the resale data file, snapshot and aggregates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('delta', help="CSV with the same columns as the resale data file.")
+
+    def handle(self, *args, **options):
+        delta_path = options['delta']
+
+        if not os.path.exists(delta_path):
+            raise CommandError(f"Delta file not found: {delta_path}")
+
+        delta = pd.read_csv(delta_path)
+        registry.current()
+
+        start = time.perf_counter()
+        added = registry.ingest(delta)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Added {added} of {len(delta)} rows in {elapsed:.3f}s (dataset version {registry.current().version})"
+        ))
@@ -0,0 +1,193 @@
+import cProfile
+import contextvars
+import glob
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+
+# Requests under this path can be sampled, except the profiling endpoints themselves
+PROFILED_PATH_PREFIX = '/api/resale/'
+PROFILING_PATH_PREFIX = '/api/resale/profiling/'
+
+# The toggle lives in this Django cache, so with a shared backend one switch reaches every
+# worker; each worker re-reads it at most once per PROFILING_POLL_INTERVAL seconds
+PROFILING_CACHE_ALIAS = 'default'
+PROFILING_STATE_KEY = 'resale-profiling'
+PROFILING_POLL_INTERVAL = 1.0
+
+
+# On/off value of a flag from a request body or query string: booleans as they are, text
+# such as "true", "1" or "yes" as on and anything else ("false", "0", "off") as off
+def parse_flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def profile_dir():
+    return getattr(settings, 'RESALE_PROFILE_DIR', None) or os.path.join(tempfile.gettempdir(), 'hdb_resale_profiles')
+
+
+def get_profiling_state():
+    return caches[PROFILING_CACHE_ALIAS].get(PROFILING_STATE_KEY) or {'enabled': False, 'fraction': 0.0}
+
+
+def set_profiling_state(enabled, fraction):
+    state = {'enabled': parse_flag(enabled), 'fraction': float(fraction)}
+    caches[PROFILING_CACHE_ALIAS].set(PROFILING_STATE_KEY, state, None)
+    return state
+
+
+def _safe_view_name(view_name):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', view_name)
+
+
+# Profiles of every view sampled in this worker, merged per view and written to
+# <profile dir>/<view>.<pid>.prof after each sample. A worker whose file was deleted
+# (clear_profiles() in any worker) starts that view over.
+class ViewProfiles:
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, view_name, profiler):
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        name = _safe_view_name(view_name)
+        path = os.path.join(directory, f"{name}.{os.getpid()}.prof")
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None or not os.path.exists(path):
+                stats = self._stats[name] = pstats.Stats(profiler)
+            else:
+                stats.add(profiler)
+            tmp_path = path + '.tmp'
+            stats.dump_stats(tmp_path)
+            os.replace(tmp_path, path)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+view_profiles = ViewProfiles()
+
+
+def _profile_files(view_name=None):
+    pattern = f"{_safe_view_name(view_name)}.*.prof" if view_name else '*.prof'
+    return sorted(glob.glob(os.path.join(profile_dir(), pattern)))
+
+
+# Views with profiles on disk (from any worker)
+def profiled_views():
+    return sorted({os.path.basename(path).split('.')[0] for path in _profile_files()})
+
+
+# Profiles of one view from every worker merged into a single pstats file; returns its path
+def merge_view_profiles(view_name):
+    files = _profile_files(view_name)
+    if not files:
+        return None
+    stats = pstats.Stats(*files)
+    handle, path = tempfile.mkstemp(suffix='.prof')
+    os.close(handle)
+    stats.dump_stats(path)
+    return path
+
+
+def clear_profiles():
+    view_profiles.clear()
+    for path in _profile_files():
+        os.remove(path)
+
+
+# Profiling lock: one request per worker is profiled at a time (from Python 3.12 only one
+# profiler can be active)
+_busy = threading.Lock()
+
+# Set for an async request picked for profiling. The profile is taken in the thread that
+# runs its view (see call_sampled), as the event loop thread never runs the view itself.
+_sampled = contextvars.ContextVar('resale_profile_sampled', default=False)
+
+
+def _call_profiled(func, request):
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        response = func()
+    finally:
+        profiler.disable()
+
+    match = request.resolver_match
+    if match is not None:
+        view_profiles.add(match.view_name, profiler)
+    return response
+
+
+# Call func() for the request, under cProfile if ProfilingMiddleware sampled the request
+def call_sampled(func, request):
+    if not _sampled.get() or not _busy.acquire(blocking=False):
+        return func()
+    try:
+        return _call_profiled(func, request)
+    finally:
+        _busy.release()
+
+
+# Runs cProfile over a sampled fraction of resale API requests while profiling is switched
+# on. When it is off, a request costs one clock read and a comparison. Under ASGI only the
+# async endpoints (async_views) are profiled, in their worker thread.
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self._state = {'enabled': False, 'fraction': 0.0}
+        self._checked = float('-inf')
+
+    def _sample(self, request):
+        now = time.monotonic()
+        if now - self._checked >= PROFILING_POLL_INTERVAL:
+            self._checked = now
+            self._state = get_profiling_state()
+
+        state = self._state
+        return (
+            state['enabled']
+            and request.path.startswith(PROFILED_PATH_PREFIX)
+            and not request.path.startswith(PROFILING_PATH_PREFIX)
+            and random.random() < state['fraction']
+        )
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        if not self._sample(request) or not _busy.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return _call_profiled(lambda: self.get_response(request), request)
+        finally:
+            _busy.release()
+
+    async def __acall__(self, request):
+        if not self._sample(request):
+            return await self.get_response(request)
+
+        token = _sampled.set(True)
+        try:
+            return await self.get_response(request)
+        finally:
+            _sampled.reset(token)
@@ -0,0 +1,270 @@
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+from django.conf import settings
+
+from .ai_prediction import ForecastTable, ForecastCache
+from .analytics import PriceAnalytics
+from .cube import AggregateCube
+from .search import AddressIndex, SearchIndex
+from .sketches import QuantileSketches
+from .trends import PriceTrends
+from .instrumentation import span
+from .dataset import (
+    DATA_FILE, SNAPSHOT_FILE, TownIndex, load_dataset, load_shared_dataset, new_resale_rows, append_resale_rows,
+    append_to_csv, file_digest, prefix_digests, read_appended_rows, write_snapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+# Per-row structures written to the shared dataset directory next to the columns (files
+# named <prefix>.<array>.npy), so workers map them instead of each building its own
+SHARED_STRUCTURES = {'addresses': AddressIndex, 'sketches': QuantileSketches}
+
+
+def shared_structure_arrays(df):
+    arrays = {}
+    for prefix, structure in SHARED_STRUCTURES.items():
+        for name, values in structure.from_frame(df).to_arrays().items():
+            arrays[f"{prefix}.{name}"] = values
+    return arrays
+
+
+def shared_structures(arrays):
+    return {
+        prefix: structure.from_arrays({
+            name[len(prefix) + 1:]: values for name, values in arrays.items() if name.startswith(prefix + '.')
+        })
+        for prefix, structure in SHARED_STRUCTURES.items()
+    }
+
+
+# One loaded version of the resale data together with every structure derived from it.
+# Instances are never modified after construction, so a request that grabbed one keeps
+# a consistent view of the data even if a newer version is swapped in meanwhile.
+class ResaleDataset:
+    def __init__(self, df, version, modified, cube=None, analytics=None, addresses=None, sketches=None,
+                 search_index=None):
+        self.df = df
+        self.version = version
+        self.modified = modified
+
+        # per town x flat_type x month totals, so aggregate views never rescan the transactions
+        self.cube = AggregateCube.from_frame(df) if cube is None else cube
+
+        # running monthly totals of every town x flat_type, for moving averages and growth
+        self.trends = PriceTrends.from_cube(self.cube)
+
+        # per sqm, lease-adjusted and percentile prices per town x flat_type x year
+        self.analytics = PriceAnalytics.from_frame(df) if analytics is None else analytics
+
+        # contiguous row range of every town, so per-town queries slice instead of masking
+        self.town_index = TownIndex(df)
+
+        # price quantile sketch of every town x flat_type x month, for quantiles over any range
+        self.sketches = QuantileSketches.from_frame(df) if sketches is None else sketches
+
+        # rows of every (town, street_name, block) in month order, and a free-text index over them
+        self.addresses = AddressIndex.from_frame(df) if addresses is None else addresses
+        self.search_index = SearchIndex.from_addresses(self.addresses) if search_index is None else search_index
+
+        # trend line of every (town, flat_type), so forecasts are a lookup instead of a model fit
+        self.forecasts = ForecastTable.from_cube(self.cube)
+
+        # forecast results for this dataset version (cleared when the version changes)
+        self.forecast_cache = ForecastCache(version)
+
+    # New dataset with typed new rows (from new_resale_rows) added. The rows are inserted
+    # into the sorted layout and the cube is updated cell by cell; the forecast table and
+    # running totals are rebuilt from the cube. Percentiles cannot be updated cell by cell,
+    # so the price analytics and quantile sketches recompute only the town x year and
+    # town x month cells that received rows, and the address index moves the new rows into
+    # their addresses' runs while the search index extends the postings of new addresses.
+    def with_rows(self, rows, version, modified):
+        if rows.empty:
+            return ResaleDataset(
+                self.df, version, modified, cube=self.cube, analytics=self.analytics, sketches=self.sketches,
+                addresses=self.addresses, search_index=self.search_index,
+            )
+
+        df, inserted = append_resale_rows(self.df, rows)
+        town_index = TownIndex(df)
+        addresses = self.addresses.with_rows(df, inserted)
+        return ResaleDataset(
+            df, version, modified,
+            cube=self.cube.with_rows(rows),
+            analytics=self.analytics.with_rows(df, town_index, rows),
+            sketches=self.sketches.with_rows(df, town_index, rows),
+            addresses=addresses,
+            search_index=self.search_index.with_addresses(addresses),
+        )
+
+
+# Load the data file (from the binary snapshot when it is fresh, or memory-mapped from a
+# shared directory when RESALE_SHARED_DATASET_DIR is set) and build the derived structures
+def load_resale_dataset(source_path=DATA_FILE, snapshot_path=SNAPSHOT_FILE):
+    shared_dir = getattr(settings, 'RESALE_SHARED_DATASET_DIR', None)
+    modified = os.path.getmtime(source_path)
+    if shared_dir:
+        df, version, arrays = load_shared_dataset(shared_dir, source_path, snapshot_path, shared_structure_arrays)
+        return ResaleDataset(df, version, modified, **shared_structures(arrays))
+    df, version = load_dataset(source_path, snapshot_path)
+    return ResaleDataset(df, version, modified)
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Holds the current ResaleDataset. Reloads build the new version off to the side and
+# then replace the reference in one assignment: requests already running finish on the
+# version they started with and new requests see the new one.
+class DatasetRegistry:
+    def __init__(self, source_path=DATA_FILE, snapshot_path=SNAPSHOT_FILE, loader=load_resale_dataset):
+        self.loader = loader
+        self.source_path = source_path
+        self.snapshot_path = snapshot_path
+        self._current = None
+        self._signature = None
+        self._load_lock = threading.Lock()
+        self._watcher = None
+
+    # The current dataset, loaded on first use (timed as the request's 'load' span)
+    def current(self):
+        dataset = self._current
+        if dataset is None:
+            with self._load_lock:
+                if self._current is None:
+                    with span('load'):
+                        self._install(self.loader(self.source_path, self.snapshot_path))
+                dataset = self._current
+        return dataset
+
+    # The current dataset if one has been loaded, without triggering a load
+    def peek(self):
+        return self._current
+
+    def _install(self, dataset):
+        self._current = dataset
+        self._signature = _file_signature(self.source_path)
+
+    # Swap in an already-built dataset
+    def swap(self, dataset):
+        with self._load_lock:
+            self._install(dataset)
+
+    # Build the dataset from the data file and swap it in. Returns the new version.
+    def reload(self):
+        with self._load_lock:
+            signature = _file_signature(self.source_path)
+            dataset = self.loader(self.source_path, self.snapshot_path)
+            self._current = dataset
+            self._signature = signature
+        logger.info("Loaded resale dataset version %s", dataset.version)
+        return dataset.version
+
+    # Bring the dataset up to date with a changed data file. When rows were only appended
+    # to the file since the dataset was loaded (its first bytes still hash to the dataset
+    # version), just the appended rows are read and added with ResaleDataset.with_rows;
+    # otherwise, and in shared mode (where workers map one copy), the file is reloaded.
+    # Returns the new version.
+    def refresh(self):
+        with self._load_lock:
+            dataset = self._append_from_file()
+        if dataset is None:
+            return self.reload()
+        logger.info("Added rows appended to the data file, dataset version %s", dataset.version)
+        return dataset.version
+
+    def _append_from_file(self):
+        current, signature = self._current, self._signature
+        file_signature = _file_signature(self.source_path)
+        if current is None or signature is None or file_signature is None or file_signature[1] <= signature[1]:
+            return None
+        if getattr(settings, 'RESALE_SHARED_DATASET_DIR', None):
+            return None
+
+        start = signature[1]
+        delta, end = read_appended_rows(start, file_signature[1], self.source_path)
+        if end == start:
+            return current
+        previous_version, version = prefix_digests(self.source_path, [start, end])
+        if previous_version != current.version:
+            return None
+
+        _, rows = new_resale_rows(current.df, current.town_index, delta)
+        dataset = current.with_rows(rows, version, file_signature[0] / 1e9)
+        self._current = dataset
+        # a line still being written is picked up by the next refresh
+        self._signature = (file_signature[0], end)
+        return dataset
+
+    # Add a raw delta frame to the current dataset and swap the result in. Only the delta
+    # is cleaned and de-duplicated, against the towns and months it touches. With persist,
+    # the new rows are also appended to the data file and the snapshot is rewritten, so
+    # restarts load them from the fast snapshot path and running workers add just the
+    # appended rows on their next refresh (see watch).
+    # Returns the number of rows added.
+    def ingest(self, delta, persist=True):
+        with self._load_lock:
+            current = self._current if self._current is not None else self.loader(self.source_path, self.snapshot_path)
+            raw_rows, rows = new_resale_rows(current.df, current.town_index, delta)
+            if rows.empty:
+                return 0
+
+            if persist:
+                append_to_csv(raw_rows, self.source_path)
+                version, modified = file_digest(self.source_path), os.path.getmtime(self.source_path)
+            else:
+                version = f"{current.version}+{pd.util.hash_pandas_object(raw_rows, index=False).sum()}"
+                modified = current.modified
+
+            dataset = current.with_rows(rows, version, modified)
+            if persist:
+                write_snapshot(dataset.df, self.source_path, self.snapshot_path)
+            self._install(dataset)
+        logger.info("Ingested %d resale rows, dataset version %s", len(raw_rows), dataset.version)
+        return len(raw_rows)
+
+    def reload_in_background(self):
+        thread = threading.Thread(target=self._reload_logged, name='resale-dataset-reload', daemon=True)
+        thread.start()
+        return thread
+
+    def _reload_logged(self):
+        try:
+            self.reload()
+        except Exception:
+            logger.exception("Reloading the resale dataset failed; keeping the current version")
+
+    def _refresh_logged(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("Refreshing the resale dataset failed; keeping the current version")
+
+    # Poll the data file every `interval` seconds and refresh when it changes
+    def watch(self, interval):
+        if self._watcher is not None:
+            return self._watcher
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                signature = _file_signature(self.source_path)
+                if signature is not None and self._signature is not None and signature != self._signature:
+                    self._refresh_logged()
+
+        self._watcher = threading.Thread(target=poll, name='resale-dataset-watcher', daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+
+registry = DatasetRegistry()
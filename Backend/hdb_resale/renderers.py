@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+from rest_framework.renderers import JSONRenderer
+
+from .instrumentation import span
+
+
+# Tabular view result: column name -> NumPy array (or list), all the same length.
+# Renderers encode it straight from the arrays instead of going through pandas records.
+class Columns(dict):
+    @classmethod
+    def from_frame(cls, frame):
+        return cls((name, frame[name].to_numpy()) for name in frame.columns)
+
+    # Plain Python lists per column (NaN becomes None so the output stays strict JSON)
+    def to_lists(self):
+        lists = {}
+        for name, values in self.items():
+            if isinstance(values, list):
+                lists[name] = values
+                continue
+            if values.dtype.kind == 'f' and np.isnan(values).any():
+                values = np.where(np.isnan(values), None, values)
+            lists[name] = values.tolist()
+        return lists
+
+    def to_records(self):
+        lists = self.to_lists()
+        names = list(lists)
+        return [dict(zip(names, row)) for row in zip(*lists.values())]
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+# Default renderer for the resale API: the usual list of records
+class ResaleJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, Columns):
+            with span('to_dict'):
+                data = data.to_records()
+            with span('render'):
+                return _dumps(data)
+        with span('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+# Column-oriented output selected with ?format=columnar: {"town": [...], "avg_price": [...]}
+class ColumnarJSONRenderer(JSONRenderer):
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, Columns):
+            with span('to_dict'):
+                data = data.to_lists()
+            with span('render'):
+                return _dumps(data)
+        with span('render'):
+            return super().render(data, accepted_media_type, renderer_context)
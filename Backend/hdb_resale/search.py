@@ -0,0 +1,281 @@
+import bisect
+import re
+
+import numpy as np
+import pandas as pd
+
+# Columns searched, and the minimum trigram similarity (Dice coefficient) of a fuzzy match
+SEARCH_COLUMNS = ('town', 'street_name', 'block')
+FUZZY_MIN_SIMILARITY = 0.5
+
+TOKEN_PATTERN = re.compile(r'[A-Z0-9]+')
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).upper())
+
+
+# Padded character trigrams of a token (as pg_trgm does), so short tokens still have some
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Positions of many contiguous (start, stop) runs, concatenated
+def _ranges(starts, stops):
+    sizes = stops - starts
+    total = int(sizes.sum())
+    if not total:
+        return np.arange(0)
+    return np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(total)
+
+
+# Rows of the given groups, from a CSR layout (group_rows ordered by group, group_starts)
+def _gather(group_rows, group_starts, groups):
+    return group_rows[_ranges(group_starts[groups], group_starts[groups + 1])]
+
+
+def _csr(keys, size):
+    order = np.argsort(keys, kind='stable')
+    starts = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=size), out=starts[1:])
+    return order, starts
+
+
+# Rows grouped by address (distinct town, street_name, block). The rows of every address
+# are one contiguous run of `rows`, in month order (the frame is sorted by town and month
+# and the grouping is stable). Each address is stored as its codes in the per-column label
+# tables, and `find` looks an address up by binary search over the addresses' sorted keys.
+# Apart from the label tables everything is a NumPy array, so the index can be written to
+# (and memory-mapped from) the shared dataset directory.
+class AddressIndex:
+    def __init__(self, categories, address_codes, rows, starts, key_order):
+        self.categories = categories
+        self.address_codes = address_codes
+        self.rows = rows
+        self.starts = starts
+        self.key_order = key_order
+        self.sorted_keys = self._keys(address_codes)[key_order]
+
+    def _keys(self, codes):
+        return np.ravel_multi_index(codes, [len(categories) for categories in self.categories])
+
+    @classmethod
+    def from_frame(cls, df):
+        # block is numeric when the file has no lettered blocks
+        columns = [
+            df[column] if isinstance(df[column].dtype, pd.CategoricalDtype) else df[column].astype(str).astype('category')
+            for column in SEARCH_COLUMNS
+        ]
+        codes = [column.cat.codes.to_numpy().astype(np.int64) for column in columns]
+        sizes = [len(column.cat.categories) for column in columns]
+
+        keys = np.ravel_multi_index(codes, sizes) if len(df) else np.arange(0)
+        address_keys, address_of_row = np.unique(keys, return_inverse=True)
+        rows, starts = _csr(address_of_row, len(address_keys))
+
+        # np.unique numbers the addresses in key order
+        categories = [pd.Index(column.cat.categories.astype(str)) for column in columns]
+        address_codes = tuple(codes.astype(np.int32) for codes in np.unravel_index(address_keys, sizes))
+        return cls(categories, address_codes, rows, starts, np.arange(len(address_keys)))
+
+    # Index of the new frame df after rows were inserted at the (sorted) offsets `inserted`
+    # (see append_resale_rows). Existing rows are renumbered, inserted rows join the run of
+    # their address (unseen addresses are numbered after the existing ones) and only the
+    # runs that received rows are re-sorted.
+    def with_rows(self, df, inserted):
+        labels = [np.asarray(df[column].iloc[inserted].astype(str), dtype=object) for column in SEARCH_COLUMNS]
+
+        # Unseen labels are appended to the label tables, so existing codes (and the order of
+        # the addresses' keys, which compare their codes column by column) stay valid
+        categories = [
+            old.append(pd.Index(np.unique(new)).difference(old)) for old, new in zip(self.categories, labels)
+        ]
+        sizes = [len(column_categories) for column_categories in categories]
+        sorted_keys = np.ravel_multi_index(self.address_codes, sizes)[self.key_order]
+
+        # Address of every inserted row, adding addresses not seen before
+        row_keys = np.ravel_multi_index([new.get_indexer(values) for new, values in zip(categories, labels)], sizes)
+        position = np.minimum(np.searchsorted(sorted_keys, row_keys), max(len(sorted_keys) - 1, 0))
+        known = (sorted_keys[position] == row_keys) if len(sorted_keys) else np.zeros(len(row_keys), dtype=bool)
+        new_keys, new_of_row = np.unique(row_keys[~known], return_inverse=True)
+        first_new = len(self)
+        address_of_row = np.empty(len(row_keys), dtype=np.int64)
+        address_of_row[known] = self.key_order[position[known]]
+        address_of_row[~known] = first_new + new_of_row
+
+        address_codes = [
+            np.concatenate([codes, new_codes.astype(np.int32)])
+            for codes, new_codes in zip(self.address_codes, np.unravel_index(new_keys, sizes))
+        ]
+        key_order = np.insert(
+            self.key_order, np.searchsorted(sorted_keys, new_keys), np.arange(first_new, first_new + len(new_keys))
+        )
+
+        # Old runs move to their new starts with renumbered rows; inserted rows follow them
+        old_sizes = np.append(np.diff(self.starts), np.zeros(len(new_keys), dtype=np.int64))
+        added = np.bincount(address_of_row, minlength=len(old_sizes))
+        starts = np.zeros(len(old_sizes) + 1, dtype=np.int64)
+        np.cumsum(old_sizes + added, out=starts[1:])
+
+        rows = np.empty(len(df), dtype=np.int64)
+        renumbered = np.delete(np.arange(len(df)), inserted)
+        shift = starts[:first_new] - self.starts[:-1]
+        rows[np.arange(len(self.rows)) + np.repeat(shift, old_sizes[:first_new])] = renumbered[self.rows]
+
+        order = np.argsort(address_of_row, kind='stable')
+        grouped = address_of_row[order]
+        rank = np.arange(len(grouped)) - np.searchsorted(grouped, grouped)
+        rows[starts[grouped] + old_sizes[grouped] + rank] = inserted[order]
+
+        # Restore month (= row) order within the runs that received rows
+        touched = np.unique(address_of_row)
+        positions = _ranges(starts[touched], starts[touched + 1])
+        runs = np.repeat(np.arange(len(touched)), starts[touched + 1] - starts[touched])
+        rows[positions] = rows[positions][np.lexsort((rows[positions], runs))]
+
+        return AddressIndex(categories, tuple(address_codes), rows, starts, key_order)
+
+    # Arrays of the index by name, and the index rebuilt from them (e.g. memory-mapped)
+    def to_arrays(self):
+        arrays = {'rows': self.rows, 'starts': self.starts, 'key_order': self.key_order}
+        for column, categories, codes in zip(SEARCH_COLUMNS, self.categories, self.address_codes):
+            arrays['uniq_' + column] = np.asarray(categories, dtype=str)
+            arrays['codes_' + column] = codes
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            [pd.Index(arrays['uniq_' + column].astype(object)) for column in SEARCH_COLUMNS],
+            tuple(arrays['codes_' + column] for column in SEARCH_COLUMNS),
+            arrays['rows'], arrays['starts'], arrays['key_order'],
+        )
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    # Address id of a (town, block, street_name), or None
+    def find(self, town, block, street_name):
+        codes = [categories.get_indexer([label])[0] for categories, label in zip(self.categories, (town, street_name, block))]
+        if min(codes) < 0:
+            return None
+        key = self._keys(codes)
+        position = np.searchsorted(self.sorted_keys, key)
+        if position == len(self.sorted_keys) or self.sorted_keys[position] != key:
+            return None
+        return int(self.key_order[position])
+
+    # Row offsets of one address, in month order
+    def address_rows(self, address):
+        return self.rows[self.starts[address]:self.starts[address + 1]]
+
+    # Row offsets of many addresses, grouped by address
+    def gather(self, addresses):
+        return _gather(self.rows, self.starts, addresses)
+
+
+# Free-text index over town, street_name and block, built once per dataset. Every token of
+# an address's text has a posting list of address ids (see AddressIndex). A query term
+# matches tokens by prefix (a range of the sorted vocabulary) or, with fuzzy, by trigram
+# similarity; all terms must match (AND, at address level), then the rows are gathered.
+class SearchIndex:
+    def __init__(self, addresses, tokens, postings, trigram_tokens, token_trigram_counts):
+        self.addresses = addresses
+        self.tokens = tokens
+        self.postings = postings
+        self.trigram_tokens = trigram_tokens
+        self.token_trigram_counts = token_trigram_counts
+
+    @classmethod
+    def from_addresses(cls, addresses):
+        return cls._from_postings(addresses, cls._token_addresses(addresses))
+
+    # Index over addresses that extend the indexed ones (see AddressIndex.with_rows): the
+    # new addresses' ids are appended to the postings of their tokens
+    def with_addresses(self, addresses):
+        first = len(self.addresses)
+        if len(addresses) == first:
+            return SearchIndex(addresses, self.tokens, self.postings, self.trigram_tokens, self.token_trigram_counts)
+
+        postings = dict(zip(self.tokens, self.postings))
+        for token, new in self._token_addresses(addresses, first).items():
+            postings[token] = np.concatenate([postings[token], new]) if token in postings else new
+        return self._from_postings(addresses, postings)
+
+    # Token -> sorted ids of the addresses from `first` on, through the labels containing it
+    @staticmethod
+    def _token_addresses(addresses, first=0):
+        token_addresses = {}
+        for categories, column_codes in zip(addresses.categories, addresses.address_codes):
+            category_addresses, category_starts = _csr(column_codes[first:], len(categories))
+            for code in np.flatnonzero(np.diff(category_starts)):
+                matching = category_addresses[category_starts[code]:category_starts[code + 1]] + first
+                for token in set(tokenize(categories[code])):
+                    token_addresses.setdefault(token, []).append(matching)
+        return {token: np.unique(np.concatenate(matching)).astype(np.int32) for token, matching in token_addresses.items()}
+
+    @classmethod
+    def _from_postings(cls, addresses, token_postings):
+        tokens = sorted(token_postings)
+        postings = [token_postings[token] for token in tokens]
+
+        trigram_tokens = {}
+        token_trigram_counts = np.zeros(len(tokens), dtype=np.int64)
+        for token_id, token in enumerate(tokens):
+            grams = trigrams(token)
+            token_trigram_counts[token_id] = len(grams)
+            for gram in grams:
+                trigram_tokens.setdefault(gram, []).append(token_id)
+        trigram_tokens = {gram: np.asarray(ids) for gram, ids in trigram_tokens.items()}
+
+        return cls(addresses, tokens, postings, trigram_tokens, token_trigram_counts)
+
+    # Ids of the vocabulary tokens starting with the term
+    def prefix_tokens(self, term):
+        start = bisect.bisect_left(self.tokens, term)
+        end = bisect.bisect_left(self.tokens, term + '\uffff')
+        return np.arange(start, end)
+
+    # Ids of the vocabulary tokens whose trigrams are similar to the term's
+    def fuzzy_tokens(self, term):
+        grams = trigrams(term)
+        matches = [self.trigram_tokens[gram] for gram in grams if gram in self.trigram_tokens]
+        if not matches:
+            return np.arange(0)
+        candidates, shared = np.unique(np.concatenate(matches), return_counts=True)
+        similarity = 2 * shared / (len(grams) + self.token_trigram_counts[candidates])
+        return candidates[similarity >= FUZZY_MIN_SIMILARITY]
+
+    # Addresses matching one query term: prefix matches, plus fuzzy matches when asked
+    def term_addresses(self, term, fuzzy=False):
+        token_ids = self.prefix_tokens(term)
+        if fuzzy:
+            token_ids = np.union1d(token_ids, self.fuzzy_tokens(term))
+        if not len(token_ids):
+            return np.arange(0)
+        if len(token_ids) == 1:
+            return self.postings[token_ids[0]]
+        return np.unique(np.concatenate([self.postings[token_id] for token_id in token_ids]))
+
+    # Sorted row offsets of the transactions matching every term of the query
+    def search(self, query, fuzzy=False):
+        terms = tokenize(query)
+        if not terms:
+            return np.arange(0)
+
+        # Intersect through a mask over address ids rather than by sorting both sides
+        addresses = None
+        matched_mask = np.zeros(len(self.addresses), dtype=bool)
+        for term in dict.fromkeys(terms):
+            matched = self.term_addresses(term, fuzzy)
+            if addresses is None:
+                addresses = matched
+            else:
+                matched_mask[matched] = True
+                addresses = addresses[matched_mask[addresses]]
+                matched_mask[matched] = False
+            if not len(addresses):
+                return np.arange(0)
+
+        return np.sort(self.addresses.gather(addresses))
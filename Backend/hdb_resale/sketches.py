@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+
+from .dataset import match_flat_types
+
+# Centroids per cell at most; cells with fewer sales keep every price exactly
+SKETCH_COMPRESSION = 32
+
+
+# Contiguous runs of a CSR layout for many (start, stop) pairs, concatenated
+def _ranges(starts, stops):
+    sizes = stops - starts
+    total = int(sizes.sum())
+    if not total:
+        return np.arange(0)
+    return np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(total)
+
+
+# Linear-interpolated quantiles from centroids (mean, weight), matching pandas' quantile
+# when every centroid is a single price. A centroid of weight w spans w consecutive ranks
+# and sits at their centre; the target rank q * (n - 1) is interpolated between centres.
+def centroid_quantiles(means, weights, qs):
+    order = np.argsort(means, kind='stable')
+    means, weights = means[order], weights[order]
+    centres = np.cumsum(weights) - weights + (weights - 1) / 2
+    targets = np.asarray(qs, dtype=np.float64) * (weights.sum() - 1)
+    return np.interp(targets, centres, means)
+
+
+# Mergeable quantile sketch (t-digest style) of resale prices for every town x flat_type x
+# month cell. Each cell's sorted prices are grouped into at most `compression` centroids
+# whose size follows the arcsine scale, so the tails stay fine-grained. A query merges the
+# centroids of the cells in range: its cost follows the number of cells, not of rows.
+class QuantileSketches:
+    def __init__(self, towns, flat_types, first_month, shape, cell_starts, means, weights):
+        self.towns = towns
+        self.flat_types = flat_types
+        self.first_month = first_month
+        self.shape = shape
+        self.cell_starts = cell_starts
+        self.means = means
+        self.weights = weights
+
+    @classmethod
+    def from_frame(cls, df, compression=SKETCH_COMPRESSION):
+        towns = np.asarray(df['town'].cat.categories, dtype=object)
+        flat_types = np.asarray(df['flat_type'].cat.categories, dtype=object)
+        months = df['month'].to_numpy()
+        prices = df['resale_price'].to_numpy(dtype=np.float64)
+        first_month = int(months.min()) if len(df) else 0
+        shape = (len(towns), len(flat_types), int(months.max()) - first_month + 1 if len(df) else 0)
+        size = int(np.prod(shape))
+
+        cells = np.ravel_multi_index(
+            (df['town'].cat.codes.to_numpy(), df['flat_type'].cat.codes.to_numpy(), months - first_month), shape
+        )
+
+        # Sort by cell then price, and rank every price within its cell
+        order = np.lexsort((prices, cells))
+        cells, prices = cells[order], prices[order]
+        count = np.bincount(cells, minlength=size)
+        cell_size = count[cells]
+        rank = np.arange(len(cells)) - (np.cumsum(count) - count)[cells]
+
+        # Centroid of each price on the arcsine scale of its quantile within the cell
+        q = (rank + 0.5) / np.maximum(cell_size, 1)
+        bucket = np.minimum((np.arcsin(2 * q - 1) / np.pi + 0.5) * compression, compression - 1).astype(np.int64)
+
+        new_centroid = np.r_[True, (cells[1:] != cells[:-1]) | (bucket[1:] != bucket[:-1])] if len(cells) else []
+        boundaries = np.flatnonzero(new_centroid)
+        weights = np.diff(np.r_[boundaries, len(cells)])
+        means = np.add.reduceat(prices, boundaries) / weights if len(cells) else np.zeros(0)
+
+        cell_starts = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells[boundaries], minlength=size), out=cell_starts[1:])
+        return cls(towns, flat_types, first_month, shape, cell_starts, means, weights.astype(np.int64))
+
+    # Sketches after typed `rows` were added, given the new frame and its TownIndex. Only the
+    # town x month blocks the rows fall in are re-sketched, from their rows of the new frame;
+    # the centroids of every other cell are copied over (the axes grow with unseen labels or
+    # months). Costs the touched rows plus one pass over the centroids.
+    def with_rows(self, df, town_index, rows):
+        towns = df['town'].cat.categories
+        touched = np.unique(np.column_stack([
+            towns.get_indexer(rows['town'].astype(object)), rows['month'].to_numpy(dtype=np.int64),
+        ]), axis=0)
+        town_pos, months = touched[:, 0], touched[:, 1]
+        part = QuantileSketches.from_frame(df.iloc[town_index.range_rows(town_pos, months, months)])
+
+        flat_types = df['flat_type'].cat.categories
+        old_months = np.arange(self.first_month, self.first_month + self.shape[2])
+        first_month = min(int(months.min()), int(old_months.min())) if len(old_months) else int(months.min())
+        last_month = max(int(months.max()), int(old_months.max())) if len(old_months) else int(months.max())
+        shape = (len(towns), len(flat_types), last_month - first_month + 1)
+
+        # Centroid count and source offset (into the old centroids followed by the new ones)
+        # of every cell of the new layout
+        sizes = np.zeros(shape, dtype=np.int64)
+        sources = np.zeros(shape, dtype=np.int64)
+        old_cells = np.ix_(towns.get_indexer(self.towns), flat_types.get_indexer(self.flat_types), old_months - first_month)
+        sizes[old_cells] = np.diff(self.cell_starts).reshape(self.shape)
+        sources[old_cells] = self.cell_starts[:-1].reshape(self.shape)
+
+        new_cells = (town_pos, slice(None), months - first_month)
+        part_cells = (town_pos, slice(None), months - part.first_month)
+        sizes[new_cells] = np.diff(part.cell_starts).reshape(part.shape)[part_cells]
+        sources[new_cells] = part.cell_starts[:-1].reshape(part.shape)[part_cells] + len(self.means)
+
+        sizes, sources = sizes.ravel(), sources.ravel()
+        cell_starts = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=cell_starts[1:])
+        centroids = _ranges(sources, sources + sizes)
+        return QuantileSketches(
+            np.asarray(towns, dtype=object), np.asarray(flat_types, dtype=object), first_month, shape, cell_starts,
+            np.concatenate([self.means, part.means])[centroids], np.concatenate([self.weights, part.weights])[centroids],
+        )
+
+    # Arrays of the sketches by name, and the sketches rebuilt from them (e.g. memory-mapped)
+    def to_arrays(self):
+        return {
+            'uniq_town': np.asarray(self.towns, dtype=str),
+            'uniq_flat_type': np.asarray(self.flat_types, dtype=str),
+            'meta_first_month': np.array(self.first_month),
+            'meta_shape': np.array(self.shape),
+            'cell_starts': self.cell_starts,
+            'means': self.means,
+            'weights': self.weights,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(
+            arrays['uniq_town'].astype(object), arrays['uniq_flat_type'].astype(object), int(arrays['meta_first_month']),
+            tuple(int(size) for size in arrays['meta_shape']), arrays['cell_starts'], arrays['means'], arrays['weights'],
+        )
+
+    # Positions of the given labels on an axis, in label order (unknown labels are dropped);
+    # flat types are matched like query values ("4-room" finds "4 ROOM")
+    def town_positions(self, labels):
+        positions = pd.Index(self.towns).get_indexer(labels)
+        return np.unique(positions[positions >= 0])
+
+    def flat_type_positions(self, labels):
+        positions = pd.Index(self.flat_types).get_indexer(match_flat_types(self.flat_types, labels))
+        return np.unique(positions[positions >= 0])
+
+    # Quantiles qs of the prices of each town over the selected flat types and months
+    # start..end (inclusive month indexes). Returns (counts, quantiles) with one row of
+    # quantiles per town (NaN for a town without sales in range).
+    def quantiles(self, qs, town_pos, flat_type_pos=None, start=None, end=None):
+        last_month = self.first_month + self.shape[2] - 1
+        start = self.first_month if start is None else max(start, self.first_month)
+        end = last_month if end is None else min(end, last_month)
+        flat_type_pos = np.arange(len(self.flat_types)) if flat_type_pos is None else np.asarray(flat_type_pos)
+
+        counts = np.zeros(len(town_pos), dtype=np.int64)
+        result = np.full((len(town_pos), len(qs)), np.nan)
+        if start > end or not len(flat_type_pos):
+            return counts, result
+
+        for row, town in enumerate(town_pos):
+            # the months of one (town, flat_type) are consecutive cells, so each flat type
+            # is one contiguous run of centroids
+            first_cells = np.ravel_multi_index(
+                (np.full(len(flat_type_pos), town), flat_type_pos, np.full(len(flat_type_pos), start - self.first_month)),
+                self.shape,
+            )
+            centroids = _ranges(self.cell_starts[first_cells], self.cell_starts[first_cells + (end - start) + 1])
+            if not len(centroids):
+                continue
+            counts[row] = self.weights[centroids].sum()
+            result[row] = centroid_quantiles(self.means[centroids], self.weights[centroids], qs)
+        return counts, result
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+# Town and flat type names with roughly the cardinality and mix of the real dataset
+TOWNS = [
+    'ANG MO KIO', 'BEDOK', 'BISHAN', 'BUKIT BATOK', 'BUKIT MERAH', 'BUKIT PANJANG', 'BUKIT TIMAH',
+    'CENTRAL AREA', 'CHOA CHU KANG', 'CLEMENTI', 'GEYLANG', 'HOUGANG', 'JURONG EAST', 'JURONG WEST',
+    'KALLANG/WHAMPOA', 'MARINE PARADE', 'PASIR RIS', 'PUNGGOL', 'QUEENSTOWN', 'SEMBAWANG', 'SENGKANG',
+    'SERANGOON', 'TAMPINES', 'TOA PAYOH', 'WOODLANDS', 'YISHUN',
+]
+FLAT_TYPES = ['1 ROOM', '2 ROOM', '3 ROOM', '4 ROOM', '5 ROOM', 'EXECUTIVE', 'MULTI-GENERATION']
+FLAT_TYPE_SHARES = [0.005, 0.02, 0.26, 0.38, 0.25, 0.08, 0.005]
+FLAT_TYPE_AREAS = [31, 45, 68, 95, 118, 145, 160]
+STOREY_RANGES = [f"{low:02d} TO {low + 2:02d}" for low in range(1, 50, 3)]
+FLAT_MODELS = ['Improved', 'New Generation', 'Model A', 'Standard', 'Simplified', 'Premium Apartment', 'Maisonette', 'Apartment', 'DBSS', 'Adjoined flat']
+
+
+# Raw resale transactions in the layout of the source CSV (strings as in the file),
+# sorted by month like the published data
+def synthetic_resale_frame(rows, seed=0, first_month='2000-01', last_month='2025-06'):
+    rng = np.random.default_rng(seed)
+    months = pd.period_range(first_month, last_month, freq='M')
+
+    town = rng.integers(0, len(TOWNS), rows)
+    flat_type = rng.choice(len(FLAT_TYPES), rows, p=FLAT_TYPE_SHARES)
+    month = np.sort(rng.integers(0, len(months), rows))
+    street = rng.integers(0, 24, rows)
+    block = rng.integers(1, 800, rows)
+    lease_start = rng.integers(1967, 2021, rows)
+
+    # Price grows over time, with a town premium and noise
+    area = np.round(np.asarray(FLAT_TYPE_AREAS)[flat_type] * rng.uniform(0.85, 1.15, rows), 1)
+    town_premium = rng.uniform(0.8, 1.3, len(TOWNS))[town]
+    trend = 1 + 0.03 * month / 12
+    price = np.round(area * 3200 * town_premium * trend * rng.lognormal(0, 0.12, rows), -3)
+
+    # Remaining lease as of the sale month, in the file's "NN years MM months" form
+    sale_year = months.year.to_numpy()[month]
+    lease_months = np.clip((lease_start + 99 - sale_year) * 12 - months.month.to_numpy()[month] + 1, 12, 99 * 12)
+    lease_years, lease_rest = np.divmod(lease_months, 12)
+    year_labels = np.array([f"{years} years " for years in range(100)], dtype=object)
+    month_labels = np.array([f"{rest:02d} months" for rest in range(12)], dtype=object)
+    remaining_lease = year_labels[lease_years] + month_labels[lease_rest]
+
+    # Text columns are built by indexing small lookup tables rather than formatting per row
+    street_names = np.array([f"{name.split('/')[0]} ST {number + 1}" for name in TOWNS for number in range(24)], dtype=object)
+    return pd.DataFrame({
+        'month': months.astype(str).to_numpy()[month],
+        'town': np.asarray(TOWNS, dtype=object)[town],
+        'flat_type': np.asarray(FLAT_TYPES, dtype=object)[flat_type],
+        'block': np.arange(800).astype(str).astype(object)[block],
+        'street_name': street_names[town * 24 + street],
+        'storey_range': np.asarray(STOREY_RANGES, dtype=object)[rng.integers(0, len(STOREY_RANGES), rows)],
+        'floor_area_sqm': area,
+        'flat_model': np.asarray(FLAT_MODELS, dtype=object)[rng.integers(0, len(FLAT_MODELS), rows)],
+        'lease_commence_date': lease_start,
+        'remaining_lease': remaining_lease,
+        'resale_price': price,
+    })
@@ -1,3 +1,901 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock, skipUnless
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils.http import http_date
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import async_views
+from .ai_prediction import FORECAST_CACHE_ALIAS, ForecastCache, ForecastTable
+from .analytics import PriceAnalytics, lease_value_fraction, remaining_lease_months
+from .caching import cached_response
+from .coalescing import SingleFlight
+from .cube import AggregateCube, year_range
+from .dataset import (
+    TownIndex, append_resale_rows, clean_resale_data, file_digest, match_flat_types, month_labels, read_resale_csv,
+    read_snapshot,
+)
+from .instrumentation import _request_spans
+from .profiling import get_profiling_state, set_profiling_state
+from .registry import DatasetRegistry, ResaleDataset, load_resale_dataset, registry
+from .sketches import QuantileSketches
+from .synthetic import synthetic_resale_frame
+from .trends import PriceTrends
+from .views import coalescing_stats, profiling
+
+QUANTILES = [0.25, 0.5, 0.75, 0.9]
+
+
+# Cube summaries against pandas groupby mean()/std() on the same rows
+class AggregateCubeTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.df = clean_resale_data(synthetic_resale_frame(50000, seed=3, first_month='2015-01', last_month='2024-12'))
+        cls.cube = AggregateCube.from_frame(cls.df)
+
+    def assertMatchesGroupby(self, summary, rows, by):
+        expected = rows.groupby(by, observed=True)['resale_price'].agg(['count', 'mean', 'std']).reset_index()
+        summary = summary.astype({name: object for name in by if name in ('town', 'flat_type')})
+        expected = expected.astype({name: object for name in by if name in ('town', 'flat_type')})
+        pd.testing.assert_frame_equal(
+            summary.reset_index(drop=True), expected, check_dtype=False, check_exact=False, rtol=1e-9
+        )
+
+    def test_summaries_match_groupby(self):
+        self.assertMatchesGroupby(self.cube.summarise(['town', 'year']), self.df, ['town', 'year'])
+        self.assertMatchesGroupby(self.cube.summarise(['flat_type', 'month']), self.df, ['flat_type', 'month'])
+
+    def test_filtered_summaries_match_groupby(self):
+        towns = ['BEDOK', 'YISHUN']
+        start, end = year_range(2018, 2020)
+        start += 2
+        rows = self.df[self.df['town'].isin(towns) & self.df['month'].between(start, end) & (self.df['flat_type'] == '4 ROOM')]
+        selection = dict(
+            towns=self.cube.town_positions(towns), flat_types=self.cube.flat_type_positions(['4 ROOM']), start=start, end=end,
+        )
+
+        self.assertMatchesGroupby(self.cube.summarise(['town'], **selection), rows, ['town'])
+        self.assertMatchesGroupby(self.cube.summarise(['year', 'town'], **selection), rows, ['year', 'town'])
+        self.assertMatchesGroupby(self.cube.summarise(['month', 'town'], **selection), rows, ['month', 'town'])
+
+        quarters = rows.assign(quarter=rows['month'] // 3)
+        self.assertMatchesGroupby(self.cube.summarise(['quarter', 'town'], **selection), quarters, ['quarter', 'town'])
+
+# Rows whose month or price does not parse are dropped on load, as the pandas groupby of
+# the original views skipped them, instead of failing the load or poisoning the totals
+class CleanResaleDataTests(SimpleTestCase):
+    def test_malformed_rows_are_dropped(self):
+        raw = synthetic_resale_frame(2000, seed=19, first_month='2020-01', last_month='2020-12')
+        malformed = raw.astype({'resale_price': object})
+        malformed.loc[3, 'month'] = 'not a month'
+        malformed.loc[7, 'resale_price'] = 'n/a'
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ('malformed.csv', 'expected.csv')]
+            malformed.to_csv(paths[0], index=False)
+            raw.drop(index=[3, 7]).to_csv(paths[1], index=False)
+            df, expected = (read_resale_csv(path) for path in paths)
+
+        pd.testing.assert_frame_equal(df, expected)
+        summary = AggregateCube.from_frame(df).summarise(['town'])
+        self.assertIn(raw.loc[7, 'town'], set(summary['town']))
+        self.assertFalse(summary['mean'].isna().any())
+
+
+
+# Ingesting a delta gives the same dataset as parsing the combined CSV from scratch
+class IngestTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_ingest_matches_full_rebuild(self):
+        synthetic_resale_frame(20000, seed=5, first_month='2020-01', last_month='2024-12').to_csv(self.path('all.csv'), index=False)
+        raw = pd.read_csv(self.path('all.csv'))
+        base, delta = raw.iloc[:18000], raw.iloc[18000:]
+        # the delta repeats some rows already in the file, which must not be added twice
+        delta = pd.concat([base.iloc[-300:], delta])
+        base.to_csv(self.path('base.csv'), index=False)
+        pd.concat([base, delta]).to_csv(self.path('combined.csv'), index=False)
+
+        registry = DatasetRegistry(self.path('base.csv'), self.path('base.npz'))
+        registry.current()
+        added = registry.ingest(delta, persist=False)
+        dataset = registry.current()
+        expected = read_resale_csv(self.path('combined.csv'))
+
+        self.assertEqual(added, 2000)
+        pd.testing.assert_frame_equal(dataset.df, expected)
+        pd.testing.assert_frame_equal(
+            dataset.cube.summarise(['town', 'flat_type', 'month']),
+            AggregateCube.from_frame(expected).summarise(['town', 'flat_type', 'month']),
+            check_exact=False, rtol=1e-9,
+        )
+
+        # the incrementally updated structures answer like ones built from the combined file
+        built = ResaleDataset(expected, 'built', 0)
+        np.testing.assert_array_equal(dataset.analytics.count, built.analytics.count)
+        for name, values in built.analytics.values.items():
+            np.testing.assert_allclose(dataset.analytics.values[name], values, rtol=1e-9)
+        for name, values in built.sketches.to_arrays().items():
+            np.testing.assert_array_equal(dataset.sketches.to_arrays()[name], values)
+        self.assertEqual(self.address_runs(dataset.addresses), self.address_runs(built.addresses))
+        for query in ('bedok', 'ang mo kio av', 'jurong west st 4'):
+            np.testing.assert_array_equal(
+                np.sort(dataset.search_index.search(query)), np.sort(built.search_index.search(query)),
+            )
+
+    def test_lettered_block_after_numeric_blocks(self):
+        # the base file has only numeric blocks, so pandas reads the column as integers
+        raw = synthetic_resale_frame(3000, seed=23, first_month='2020-01', last_month='2020-12')
+        base, delta = raw.iloc[:2900], raw.iloc[2900:].copy()
+        delta.loc[delta.index[:5], 'block'] = '123A'
+        base.to_csv(self.path('base.csv'), index=False)
+        pd.concat([base, delta]).to_csv(self.path('combined.csv'), index=False)
+
+        registry = DatasetRegistry(self.path('base.csv'), self.path('base.npz'))
+        registry.current()
+        added = registry.ingest(delta, persist=False)
+        dataset = registry.current()
+
+        self.assertEqual(added, 100)
+        pd.testing.assert_frame_equal(dataset.df, read_resale_csv(self.path('combined.csv')))
+        row = delta.iloc[0]
+        address = dataset.addresses.find(row['town'], '123A', row['street_name'])
+        expected = (delta['town'] == row['town']) & (delta['street_name'] == row['street_name']) & (delta['block'] == '123A')
+        self.assertEqual(len(dataset.addresses.address_rows(address)), expected.sum())
+
+    def test_persisted_ingest_reaches_running_workers(self):
+        raw = synthetic_resale_frame(5000, seed=29, first_month='2020-01', last_month='2021-12')
+        raw.iloc[:4500].to_csv(self.path('data.csv'), index=False)
+        delta = raw.iloc[4500:]
+
+        loads = []
+
+        def loader(source_path, snapshot_path):
+            loads.append(source_path)
+            return load_resale_dataset(source_path, snapshot_path)
+
+        writer = DatasetRegistry(self.path('data.csv'), self.path('data.npz'))
+        worker = DatasetRegistry(self.path('data.csv'), self.path('data.npz'), loader=loader)
+        writer.current()
+        worker.current()
+
+        # the rows go to the data file and the snapshot
+        self.assertEqual(writer.ingest(delta), 500)
+        expected = read_resale_csv(self.path('data.csv'))
+        version = file_digest(self.path('data.csv'))
+        self.assertEqual(writer.current().version, version)
+        pd.testing.assert_frame_equal(writer.current().df, expected)
+        snapshot, snapshot_version = read_snapshot(self.path('data.npz'), self.path('data.csv'))
+        self.assertEqual(snapshot_version, version)
+        pd.testing.assert_frame_equal(snapshot, expected)
+
+        # a running worker adds just the appended rows
+        self.assertEqual(worker.refresh(), version)
+        self.assertEqual(len(loads), 1)
+        pd.testing.assert_frame_equal(worker.current().df, expected)
+        self.assertEqual(len(worker.current().sketches.means), len(QuantileSketches.from_frame(expected).means))
+
+        # a file changed other than by appending is loaded again
+        raw.iloc[:4000].to_csv(self.path('data.csv'), index=False)
+        worker.refresh()
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(len(worker.current().df), 4000)
+
+    @staticmethod
+    def address_runs(addresses):
+        runs = {}
+        for address in range(len(addresses)):
+            labels = tuple(categories[codes[address]] for categories, codes in zip(addresses.categories, addresses.address_codes))
+            runs[labels] = addresses.address_rows(address).tolist()
+        return runs
+
+
+# Sketch quantiles against exact pandas quantiles on synthetic transactions
+class QuantileSketchesTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.df = clean_resale_data(synthetic_resale_frame(100000, seed=7, first_month='2015-01', last_month='2024-12'))
+        cls.sketches = QuantileSketches.from_frame(cls.df)
+
+    def exact_prices(self, town, flat_type, start, end):
+        df = self.df
+        mask = (df['town'] == town) & (df['month'] >= start) & (df['month'] <= end)
+        if flat_type is not None:
+            mask &= df['flat_type'] == flat_type
+        return np.sort(df.loc[mask, 'resale_price'].to_numpy(dtype=np.float64))
+
+    def test_quantiles_are_within_rank_and_value_error_bounds(self):
+        rng = np.random.default_rng(0)
+        sketches = self.sketches
+        last_month = sketches.first_month + sketches.shape[2] - 1
+
+        for _ in range(40):
+            start, end = sorted(rng.integers(sketches.first_month, last_month + 1, 2))
+            town = rng.integers(len(sketches.towns))
+            flat_type = rng.choice([None, '3 ROOM', '4 ROOM'])
+            flat_type_pos = None if flat_type is None else sketches.flat_type_positions([flat_type])
+
+            counts, estimates = sketches.quantiles(QUANTILES, [town], flat_type_pos, start, end)
+            prices = self.exact_prices(sketches.towns[town], flat_type, start, end)
+
+            self.assertEqual(counts[0], len(prices))
+            if len(prices) < 50:
+                continue
+            exact = np.quantile(prices, QUANTILES)
+            ranks = np.searchsorted(prices, estimates[0]) / len(prices)
+            np.testing.assert_array_less(np.abs(ranks - QUANTILES), 0.03)
+            np.testing.assert_allclose(estimates[0], exact, rtol=0.02)
+
+    def test_whole_history_of_every_town_is_within_error_bounds(self):
+        sketches = self.sketches
+        counts, estimates = sketches.quantiles(QUANTILES, np.arange(len(sketches.towns)))
+
+        for town, count, estimate in zip(sketches.towns, counts, estimates):
+            prices = np.sort(self.df.loc[self.df['town'] == town, 'resale_price'].to_numpy(dtype=np.float64))
+            self.assertEqual(count, len(prices))
+            ranks = np.searchsorted(prices, estimate) / len(prices)
+            np.testing.assert_array_less(np.abs(ranks - QUANTILES), 0.01)
+            np.testing.assert_allclose(estimate, np.quantile(prices, QUANTILES), rtol=0.01)
+
+    def test_with_rows_matches_rebuild(self):
+        df = self.df
+        # the added rows bring new months and a town the base has never seen
+        new_town = df['town'].cat.categories[-1]
+        last_months = df['month'] > df['month'].max() - 3
+        added = (df['town'] == new_town) | last_months | (np.random.default_rng(1).random(len(df)) < 0.05)
+        base, rows = df[~added].copy(), df[added]
+        base['town'] = base['town'].cat.remove_unused_categories()
+
+        combined, _ = append_resale_rows(base, rows)
+        updated = QuantileSketches.from_frame(base).with_rows(combined, TownIndex(combined), rows)
+        built = QuantileSketches.from_frame(combined)
+
+        self.assertEqual(updated.shape, built.shape)
+        self.assertEqual(updated.first_month, built.first_month)
+        for name, values in built.to_arrays().items():
+            np.testing.assert_array_equal(updated.to_arrays()[name], values)
+
+    def test_small_cells_are_exact(self):
+        sketches = self.sketches
+        month = sketches.first_month + 5
+        town = sketches.towns[0]
+        prices = self.exact_prices(town, None, month, month)
+
+        counts, estimates = sketches.quantiles(QUANTILES, [0], None, month, month)
+
+        self.assertEqual(counts[0], len(prices))
+        np.testing.assert_allclose(estimates[0], np.quantile(prices, QUANTILES))
+
+    def test_empty_range_has_no_quantiles(self):
+        counts, estimates = self.sketches.quantiles(QUANTILES, [0], [], None, None)
+
+        self.assertEqual(counts[0], 0)
+        self.assertTrue(np.isnan(estimates).all())
+
+
+# Moving averages, year-over-year change and growth against pandas rolling() and pct_change(12)
+# over the monthly totals of every town, on data with months missing from every town and a
+# gap longer than the window in one
+class PriceTrendsTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        df = clean_resale_data(synthetic_resale_frame(30000, seed=11, first_month='2019-01', last_month='2023-12'))
+        months = df['month'] - df['month'].min()
+        gap_town = df['town'].cat.categories[0]
+        cls.df = df[(months != 20) & ~((df['town'] == gap_town) & months.between(30, 34))]
+        cls.trends = PriceTrends.from_cube(AggregateCube.from_frame(cls.df))
+
+    def expected(self, df, window):
+        months = pd.RangeIndex(df['month'].min(), df['month'].max() + 1, name='month')
+        frames = []
+        for town, rows in df.groupby('town', observed=True):
+            monthly = rows.groupby('month')['resale_price'].agg(['sum', 'count']).reindex(months, fill_value=0)
+            rolling = monthly.rolling(window, min_periods=1).sum()
+            moving_avg = (rolling['sum'] / rolling['count']).where(rolling['count'] > 0)
+            years = (months - months[0]) / 12
+            frames.append(pd.DataFrame({
+                'town': town,
+                'month': months,
+                'count': rolling['count'].astype(np.int64),
+                'moving_avg': moving_avg,
+                'yoy': moving_avg.pct_change(12, fill_method=None),
+                'cagr': np.where(years > 0, (moving_avg / moving_avg.iloc[0]) ** (1 / np.where(years > 0, years, 1)) - 1, np.nan),
+            }))
+        expected = pd.concat(frames)
+        return expected[expected['count'] > 0].reset_index(drop=True)
+
+    def test_summary_matches_pandas(self):
+        towns = list(self.df['town'].cat.categories)
+        for window in (3, 12):
+            for flat_type in (None, '4 ROOM'):
+                with self.subTest(window=window, flat_type=flat_type):
+                    df = self.df if flat_type is None else self.df[self.df['flat_type'] == flat_type]
+                    result = self.trends.summarise(towns, flat_type=flat_type, window=window)
+                    expected = self.expected(df, window)
+
+                    self.assertEqual(list(result['town']), list(expected['town']))
+                    np.testing.assert_array_equal(result['month'], expected['month'])
+                    np.testing.assert_array_equal(result['count'], expected['count'])
+                    for column in ('moving_avg', 'yoy', 'cagr'):
+                        np.testing.assert_allclose(result[column], expected[column], rtol=1e-9, err_msg=column)
+
+    def test_gap_longer_than_the_window_has_no_rows(self):
+        gap_town = self.df['town'].cat.categories[0]
+        first_month = int(self.df['month'].min())
+
+        result = self.trends.summarise([gap_town], window=3)
+
+        gap = set(range(first_month + 32, first_month + 35))
+        self.assertFalse(gap & set(result['month']))
+        self.assertIn(first_month + 35, set(result['month']))
+
+
+# Per town x year analytics against pandas groupby mean() and quantile() on the same rows
+class PriceAnalyticsTests(SimpleTestCase):
+    STATISTICS = ['p10', 'p50', 'p90', 'price_per_sqm', 'lease_adjusted']
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.df = clean_resale_data(synthetic_resale_frame(20000, seed=37, first_month='2018-01', last_month='2023-12'))
+        cls.analytics = PriceAnalytics.from_frame(cls.df)
+
+    def expected(self, rows):
+        lease_years = rows['remaining_lease'].astype(str).str.extract(r'(\d+) years (\d+) months').astype(float)
+        lease = (lease_years[0] + lease_years[1] / 12).to_numpy()
+        rows = rows.assign(
+            price_per_sqm=rows['resale_price'] / rows['floor_area_sqm'],
+            lease_adjusted=rows['resale_price'] * (1 - 1.035 ** -99) / (1 - 1.035 ** -lease),
+        )
+        grouped = rows.groupby(['town', 'year'], observed=True)
+        expected = pd.DataFrame({
+            'p10': grouped['resale_price'].quantile(0.1),
+            'p50': grouped['resale_price'].quantile(0.5),
+            'p90': grouped['resale_price'].quantile(0.9),
+            'price_per_sqm': grouped['price_per_sqm'].mean(),
+            'lease_adjusted': grouped['lease_adjusted'].mean(),
+        })
+        return expected.reset_index().astype({'town': str, 'year': np.int64})
+
+    def test_statistics_match_pandas(self):
+        towns = ['BEDOK', 'TAMPINES', 'YISHUN']
+        for flat_type in (None, '4 ROOM'):
+            rows = self.df[self.df['town'].isin(towns)]
+            if flat_type:
+                rows = rows[rows['flat_type'] == flat_type]
+            summary = self.analytics.summarise(self.STATISTICS, towns, flat_type)
+
+            pd.testing.assert_frame_equal(
+                summary.astype({'town': str, 'year': np.int64}), self.expected(rows), check_exact=False, rtol=1e-9,
+            )
+
+    def test_remaining_lease_labels(self):
+        labels = pd.Series(['61 years 04 months', '70 years', '85', ' 9 years 1 month ', 'unknown'])
+        expected = [61 * 12 + 4, 70 * 12, 85 * 12, 9 * 12 + 1, -1]
+
+        self.assertEqual(remaining_lease_months(labels).tolist(), expected)
+        self.assertEqual(remaining_lease_months(labels.astype('category')).tolist(), expected)
+        np.testing.assert_allclose(lease_value_fraction([99 * 12, 0]), [1, 0])
+
+
+# Forecast table predictions against a scikit-learn LinearRegression fitted per request on
+# the yearly mean prices, which the table replaced
+class ForecastTableTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.df = clean_resale_data(synthetic_resale_frame(50000, seed=11, first_month='2012-01', last_month='2024-12'))
+        cls.forecasts = ForecastTable.from_cube(AggregateCube.from_frame(cls.df))
+
+    def reference_predictions(self, town, years, base_year, flat_type=None):
+        from sklearn.linear_model import LinearRegression
+
+        rows = self.df[self.df['town'] == town]
+        if flat_type:
+            rows = rows[rows['flat_type'] == flat_type]
+        yearly_avg = rows.groupby('year')['resale_price'].mean().reset_index()
+
+        model = LinearRegression().fit(yearly_avg['year'].to_numpy().reshape(-1, 1), yearly_avg['resale_price'].to_numpy())
+        return model.predict(np.arange(base_year, base_year + years).reshape(-1, 1))
+
+    def test_predictions_match_linear_regression(self):
+        for town, flat_type in [('BEDOK', None), ('TAMPINES', '4 ROOM'), ('YISHUN', 'EXECUTIVE')]:
+            result = self.forecasts.predict(town, years=5, base_year=2025, flat_type=flat_type)
+            predicted = [prediction['predicted_price'] for prediction in result['predictions']]
+            np.testing.assert_allclose(predicted, self.reference_predictions(town, 5, 2025, flat_type), atol=0.01)
+
+    def test_unknown_town_is_an_error(self):
+        self.assertEqual(self.forecasts.predict('NOWHERE'), {"error": "No data found for NOWHERE"})
+
+
+# Forecast cache entries are per dataset version and town (in any case), and binding a new
+# version leaves other keys of a possibly shared cache alone
+class ForecastCacheTests(SimpleTestCase):
+    def test_versions_share_the_alias_without_clearing_it(self):
+        cache = caches[FORECAST_CACHE_ALIAS]
+        cache.set('unrelated', 1)
+        calls = []
+
+        def compute(town, **kwargs):
+            calls.append(town)
+            return {'town': town}
+
+        first = ForecastCache(self.id() + '-1')
+        self.assertEqual(first.get_or_compute(compute, 'bedok'), {'town': 'BEDOK'})
+        self.assertEqual(first.get_or_compute(compute, ' BEDOK'), {'town': 'BEDOK'})
+        second = ForecastCache(self.id() + '-2')
+        second.get_or_compute(compute, 'Bedok')
+
+        self.assertEqual(calls, ['BEDOK', 'BEDOK'])
+        self.assertEqual(first.stats()['hits'], 1)
+        self.assertEqual(cache.get('unrelated'), 1)
+
+
+# Serves a synthetic dataset through the registry for the duration of the test class
+class SyntheticDatasetTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        df = clean_resale_data(synthetic_resale_frame(50000, seed=13, first_month='2017-01', last_month='2024-12'))
+        cls.dataset = ResaleDataset(df, cls.__name__, 0)
+        cls.previous = registry.peek()
+        registry.swap(cls.dataset)
+
+    @classmethod
+    def tearDownClass(cls):
+        registry.swap(cls.previous)
+        super().tearDownClass()
+
+
+# Query flat types match the dataset's labels in normalised form, whether or not the label
+# itself has a hyphen ("4-room" finds "4 ROOM", "Multi-Generation" finds "MULTI-GENERATION")
+class FlatTypeMatchingTests(SyntheticDatasetTestCase):
+
+    def test_query_values_match_labels(self):
+        categories = ['3 ROOM', '4 ROOM', 'MULTI-GENERATION']
+        self.assertEqual(match_flat_types(categories, ['4-room', ' 4 Room ']), ['4 ROOM', '4 ROOM'])
+        self.assertEqual(match_flat_types(categories, ['MULTI-GENERATION', 'Multi Generation']), ['MULTI-GENERATION'] * 2)
+        self.assertEqual(match_flat_types(categories, ['5 ROOM']), [])
+
+    def test_raw_data_by_town_finds_hyphenated_flat_types(self):
+        df = self.dataset.df
+        expected = ((df['town'] == 'BEDOK') & (df['flat_type'] == 'MULTI-GENERATION') & (df['year'] >= 2017)).sum()
+        self.assertGreater(expected, 0)
+
+        for room_type in ('MULTI-GENERATION', 'Multi-Generation', 'multi generation'):
+            response = self.client.get('/api/resale/raw_data_by_town/', {'town': 'BEDOK', 'room_type': room_type})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), expected)
+            self.assertEqual({row['flat_type'] for row in response.json()}, {'MULTI-GENERATION'})
+
+    def test_derived_structures_find_hyphenated_flat_types(self):
+        dataset = self.dataset
+        for structure in (dataset.cube, dataset.sketches):
+            self.assertEqual(
+                structure.flat_type_positions(['Multi-Generation']).tolist(),
+                [structure.flat_types.tolist().index('MULTI-GENERATION')],
+            )
+        self.assertNotIn('error', dataset.forecasts.predict('BEDOK', flat_type='Multi-Generation'))
+        self.assertFalse(dataset.analytics.summarise(['p50'], ['BEDOK'], 'Multi-Generation').empty)
+        self.assertFalse(dataset.trends.summarise(['BEDOK'], 'Multi-Generation').empty)
+        self.assertFalse(dataset.trends.summarise(['BEDOK'], '4-room').empty)
+
+
+# The response cache: responses are keyed on the normalised query, bodies up to
+# RESALE_RESPONSE_CACHE_MAX_BYTES are kept, and conditional requests get 304 Not Modified
+@override_settings(RESALE_RESPONSE_CACHE_MAX_BYTES=1000)
+class ResponseCacheTests(SimpleTestCase):
+    MODIFIED = 1700000000
+
+    def cached_view(self, size=10):
+        calls = []
+
+        @cached_response(lambda: self.id(), lambda: self.MODIFIED)
+        def view(request):
+            calls.append(request)
+            return HttpResponse(b'x' * size)
+
+        return view, calls
+
+    def test_small_responses_are_cached(self):
+        view, calls = self.cached_view(1000)
+        for _ in range(3):
+            response = view(RequestFactory().get('/api/resale/towns/'))
+        self.assertEqual(len(response.content), 1000)
+        self.assertEqual(len(calls), 1)
+
+    def test_large_responses_are_not_cached(self):
+        view, calls = self.cached_view(1001)
+        for _ in range(3):
+            response = view(RequestFactory().get('/api/resale/towns/'))
+        self.assertEqual(len(response.content), 1001)
+        self.assertIn('ETag', response)
+        self.assertEqual(len(calls), 3)
+
+    def test_conditional_requests_are_not_modified(self):
+        view, calls = self.cached_view()
+        response = view(RequestFactory().get('/api/resale/towns/'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Last-Modified'], http_date(self.MODIFIED))
+
+        etag = response['ETag']
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': http_date(self.MODIFIED)}):
+            response = view(RequestFactory().get('/api/resale/towns/', **headers))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+        response = view(RequestFactory().get('/api/resale/towns/', HTTP_IF_NONE_MATCH='"stale"'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(calls), 1)
+
+    def test_equivalent_queries_share_an_entry(self):
+        view, calls = self.cached_view()
+        for query in (
+            'towns=bedok&towns=yishun&room_type=4-room&start_year=2020',
+            'start_year=2020&room_type=4%20Room&towns=YISHUN&towns=Bedok',
+        ):
+            view(RequestFactory().get('/api/resale/resale_analysis/?' + query))
+        self.assertEqual(len(calls), 1)
+
+        view(RequestFactory().get('/api/resale/resale_analysis/?towns=BEDOK&room_type=4-room&start_year=2021'))
+        self.assertEqual(len(calls), 2)
+
+
+# Requests that differ only in the order or case of their towns share a cache entry, so
+# they must also get the same body
+class ForecastBulkTests(SyntheticDatasetTestCase):
+    def test_town_order_and_case_do_not_change_the_body(self):
+        first = self.client.get('/api/resale/ai_predict_bulk/?towns=yishun&towns=bedok')
+        second = self.client.get('/api/resale/ai_predict_bulk/?towns=BEDOK&towns=Yishun')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual([result['town'] for result in second.json()['results']], ['BEDOK', 'YISHUN'])
+        self.assertEqual(second.json()['results'][0], self.dataset.forecasts.predict('BEDOK'))
+
+
+# On a cold worker the dataset load is timed in its own span, not in the cache lookup
+class LoadSpanTests(SimpleTestCase):
+    def test_lazy_load_is_not_timed_as_cache(self):
+        def loader(source_path, snapshot_path):
+            time.sleep(0.05)
+            return ResaleDataset(clean_resale_data(synthetic_resale_frame(1000, seed=31)), self.id(), 0)
+
+        cold = DatasetRegistry(loader=loader)
+
+        @cached_response(lambda: cold.current().version)
+        def view(request):
+            return HttpResponse(b'ok')
+
+        spans = []
+        token = _request_spans.set(spans)
+        try:
+            view(RequestFactory().get('/api/resale/towns/'))
+        finally:
+            _request_spans.reset(token)
+
+        durations = dict(spans)
+        self.assertGreaterEqual(durations['load'], 0.05)
+        self.assertLess(durations['cache'], 0.05)
+
+
+# Malformed years get a 400 from the single endpoints, as from the batch endpoint
+class YearValidationTests(SyntheticDatasetTestCase):
+    def test_invalid_years_are_rejected(self):
+        for path, params in (
+            ('resale_analysis', {'towns': 'BEDOK', 'type': 'price_trends'}),
+            ('resale_analysis', {'towns': 'BEDOK', 'type': 'percentiles'}),
+            ('resale_analysis', {'towns': 'BEDOK', 'type': 'median'}),
+            ('resale_roomtype_trends', {'town': 'BEDOK'}),
+        ):
+            response = self.client.get(f'/api/resale/{path}/', {**params, 'start_year': 'x', 'end_year': '2020'})
+            self.assertEqual(response.status_code, 400, (path, params))
+            self.assertIn('error', response.json())
+
+            response = self.client.get(f'/api/resale/{path}/', {**params, 'start_year': '2019', 'end_year': '2020'})
+            self.assertEqual(response.status_code, 200, (path, params))
+
+
+# A batched query that fails does not take the other results down with it
+class BatchTests(SyntheticDatasetTestCase):
+    def test_invalid_item_gets_its_own_error(self):
+        queries = [
+            {'id': 'bad', 'query': 'resale_analysis', 'params': {'towns': ['BEDOK'], 'start_year': 'x', 'end_year': '2020'}},
+            {'id': 'good', 'query': 'resale_comparison', 'params': {'towns': ['BEDOK'], 'start_year': '2020-01', 'end_year': '2020-12'}},
+        ]
+        response = self.client.post('/api/resale/batch/', {'queries': queries}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        bad, good = response.json()['results']
+        self.assertEqual((bad['id'], bad['status']), ('bad', 400))
+        self.assertEqual((good['id'], good['status']), ('good', 200))
+        self.assertEqual([row['town'] for row in good['data']], ['BEDOK'])
+
+
+# Search endpoint results against a word-prefix match over the address text with pandas
+class SearchEndpointTests(SyntheticDatasetTestCase):
+    def expected_rows(self, query):
+        df = self.dataset.df
+        text = df['town'].astype(str) + ' ' + df['street_name'].astype(str) + ' ' + df['block'].astype(str)
+        mask = np.ones(len(df), dtype=bool)
+        for term in query.upper().split():
+            mask &= text.str.contains(r'(?:^|[^A-Z0-9])' + term).to_numpy()
+        return df[mask]
+
+    def search(self, **params):
+        response = self.client.get('/api/resale/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_every_word_matches_the_start_of_an_address_word(self):
+        expected = self.expected_rows('tamp st 12')
+        self.assertGreater(len(expected), 0)
+
+        result = self.search(q='tamp st 12', limit=5000)
+
+        self.assertEqual(result['count'], len(expected))
+        self.assertEqual(
+            [(row['street_name'], row['block'], row['resale_price']) for row in result['results']],
+            list(zip(expected['street_name'], expected['block'], expected['resale_price'])),
+        )
+
+    def test_pages_cover_the_results_once(self):
+        pages, cursor = [], 0
+        while cursor is not None:
+            page = self.search(q='bedok st 3', limit=7, cursor=cursor)
+            pages.append(page['results'])
+            cursor = page['next_cursor']
+
+        rows = [row for page in pages for row in page]
+        self.assertEqual(page['count'], len(self.expected_rows('bedok st 3')))
+        self.assertEqual(len(rows), page['count'])
+        self.assertTrue(all(len(page) == 7 for page in pages[:-1]))
+        self.assertEqual(rows, self.search(q='bedok st 3', limit=5000)['results'])
+
+    def test_misspelt_words_match_only_with_fuzzy(self):
+        self.assertEqual(self.search(q='tampnes')['count'], 0)
+        self.assertEqual(self.search(q='tampnes', fuzzy='true')['count'], len(self.expected_rows('tampines')))
+
+    def test_unmatched_and_invalid_queries(self):
+        self.assertEqual(self.search(q='zzzz'), {'count': 0, 'next_cursor': None, 'results': []})
+        for params in ({}, {'q': ' '}, {'q': 'bedok', 'limit': 0}, {'q': 'bedok', 'cursor': 'x'}):
+            self.assertEqual(self.client.get('/api/resale/search/', params).status_code, 400, params)
+
+
+# Block history against the address's rows selected with pandas
+class BlockHistoryTests(SyntheticDatasetTestCase):
+    def test_history_matches_the_address_rows(self):
+        df = self.dataset.df
+        town, block, street_name = df.groupby(['town', 'block', 'street_name'], observed=True).size().idxmax()
+        expected = df[(df['town'] == town) & (df['block'] == block) & (df['street_name'] == street_name)]
+        self.assertGreater(len(expected), 1)
+
+        response = self.client.get('/api/resale/block_history/', {
+            'town': town.lower(), 'block': ' %s ' % block, 'street_name': '  ' + street_name.lower().replace(' ', '   '),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(
+            [(row['month'], row['resale_price']) for row in result['transactions']],
+            list(zip(month_labels(expected['month']), expected['resale_price'])),
+        )
+        monthly = expected.groupby('month')['resale_price'].agg(['count', 'mean'])
+        self.assertEqual([row['month'] for row in result['monthly']], list(month_labels(monthly.index)))
+        self.assertEqual([row['count'] for row in result['monthly']], monthly['count'].tolist())
+        np.testing.assert_allclose([row['avg_price'] for row in result['monthly']], monthly['mean'])
+
+    def test_unknown_address_is_empty(self):
+        for params in ({'town': 'BEDOK', 'block': '9999', 'street_name': 'BEDOK ST 12'},
+                       {'town': 'BEDOK', 'block': '1', 'street_name': 'NO SUCH ST'}):
+            response = self.client.get('/api/resale/block_history/', params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {'transactions': [], 'monthly': []})
+
+    def test_missing_parameters(self):
+        response = self.client.get('/api/resale/block_history/', {'town': 'BEDOK', 'block': '1'})
+        self.assertEqual(response.status_code, 400)
+
+
+# In shared mode the per-row indexes are memory-mapped from the shared directory and answer
+# like the ones a worker builds itself
+@skipUnless(os.name == 'posix', "the shared dataset lock uses fcntl")
+class SharedDatasetTests(SimpleTestCase):
+    def test_shared_structures_match_built_ones(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source, snapshot = os.path.join(directory, 'data.csv'), os.path.join(directory, 'data.npz')
+            synthetic_resale_frame(20000, seed=17).to_csv(source, index=False)
+            built = load_resale_dataset(source, snapshot)
+            with self.settings(RESALE_SHARED_DATASET_DIR=os.path.join(directory, 'shared')):
+                load_resale_dataset(source, snapshot)
+                shared = load_resale_dataset(source, snapshot)
+
+            self.assertIsInstance(shared.addresses.rows, np.memmap)
+            self.assertIsInstance(shared.sketches.means, np.memmap)
+            row = built.df.iloc[100]
+            labels = (row['town'], str(row['block']), row['street_name'])
+            address = built.addresses.find(*labels)
+            self.assertIsNotNone(address)
+            self.assertEqual(shared.addresses.find(*labels), address)
+            np.testing.assert_array_equal(shared.addresses.address_rows(address), built.addresses.address_rows(address))
+            np.testing.assert_array_equal(shared.search_index.search('bedok st 3'), built.search_index.search('bedok st 3'))
+            np.testing.assert_array_equal(
+                shared.sketches.quantiles(QUANTILES, [0, 1])[1], built.sketches.quantiles(QUANTILES, [0, 1])[1]
+            )
+
+
+# The profiling switch reads "false" in a request body as off
+class ProfilingSwitchTests(SimpleTestCase):
+    def tearDown(self):
+        set_profiling_state(False, 0.0)
+
+    def switch(self, body):
+        request = APIRequestFactory().post('/api/resale/profiling/', body, format='json')
+        force_authenticate(request, user=get_user_model()(is_staff=True))
+        return profiling(request)
+
+    def test_enabled_flag_is_parsed(self):
+        for value, expected in ((True, True), ('true', True), ('1', True), (False, False), ('false', False), ('0', False)):
+            response = self.switch({'enabled': value, 'fraction': 0.5})
+            self.assertEqual(response.status_code, 200)
+            self.assertIs(get_profiling_state()['enabled'], expected)
+
+
+# Async views: admission limit (503), timeout (504) and sync streams pulled through the pool
+class AsyncViewTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='resale-async-test')
+        self.in_flight = threading.BoundedSemaphore(1)
+        for name, value in (('_executor', self.executor), ('_in_flight', self.in_flight)):
+            patcher = mock.patch.object(async_views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.executor.shutdown)
+
+    def assertSlotFree(self):
+        self.assertTrue(self.in_flight.acquire(timeout=1))
+        self.in_flight.release()
+
+    async def test_requests_beyond_the_limit_get_503(self):
+        release = threading.Event()
+
+        @async_views.async_view
+        def view(request):
+            release.wait(5)
+            return HttpResponse(b'done')
+
+        first = asyncio.ensure_future(view(RequestFactory().get('/')))
+        await asyncio.sleep(0.05)
+        busy = await view(RequestFactory().get('/'))
+        release.set()
+
+        self.assertEqual(busy.status_code, 503)
+        self.assertEqual((await first).content, b'done')
+        self.assertSlotFree()
+
+    @override_settings(RESALE_ASYNC_TIMEOUT=0.05)
+    async def test_slow_requests_get_504(self):
+        @async_views.async_view
+        def view(request):
+            time.sleep(0.2)
+            return HttpResponse(b'late')
+
+        response = await view(RequestFactory().get('/'))
+
+        self.assertEqual(response.status_code, 504)
+        self.assertFalse(self.in_flight.acquire(blocking=False))
+        self.assertSlotFree()
+
+    async def test_sync_streams_are_pulled_through_the_pool(self):
+        threads = []
+
+        def chunks():
+            for index in range(3):
+                threads.append(threading.current_thread().name)
+                yield f'{index},'
+
+        @async_views.async_view
+        def view(request):
+            return StreamingHttpResponse(chunks())
+
+        response = await view(RequestFactory().get('/'))
+        self.assertTrue(response.is_async)
+        self.assertFalse(self.in_flight.acquire(blocking=False))
+
+        body = b''.join([chunk async for chunk in response])
+
+        self.assertEqual(body, b'0,1,2,')
+        self.assertTrue(all(name.startswith('resale-async-test') for name in threads))
+        self.assertSlotFree()
+
+
+# Concurrent calls with one key run the function once; the others get its result or error
+class SingleFlightTests(SimpleTestCase):
+    CALLERS = 8
+
+    def run_callers(self, flights, compute):
+        outcomes = [None] * self.CALLERS
+
+        def call(index):
+            try:
+                outcomes[index] = flights.do('key', compute)
+            except ValueError as error:
+                outcomes[index] = error
+
+        threads = [threading.Thread(target=call, args=(index,)) for index in range(self.CALLERS)]
+        for thread in threads:
+            thread.start()
+        return threads, outcomes
+
+    def wait_for_waiters(self, flights):
+        deadline = time.monotonic() + 5
+        while flights.stats()['keys'].get('key', {}).get('waits', 0) < self.CALLERS - 1:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def test_waiters_get_the_leaders_result(self):
+        flights, release, calls = SingleFlight(), threading.Event(), []
+
+        def compute():
+            calls.append(threading.current_thread().name)
+            release.wait(5)
+            return object()
+
+        threads, outcomes = self.run_callers(flights, compute)
+        self.wait_for_waiters(flights)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len({id(result) for result, led in outcomes}), 1)
+        self.assertEqual(sum(led for result, led in outcomes), 1)
+        self.assertEqual(flights.stats()['in_flight'], 0)
+
+    def test_leaders_error_reaches_waiters_and_clears_the_key(self):
+        flights, release = SingleFlight(), threading.Event()
+
+        def compute():
+            release.wait(5)
+            raise ValueError('failed')
+
+        threads, outcomes = self.run_callers(flights, compute)
+        self.wait_for_waiters(flights)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(all(isinstance(outcome, ValueError) for outcome in outcomes))
+        self.assertEqual(flights.stats()['in_flight'], 0)
+        self.assertEqual(flights.do('key', lambda: 'again'), ('again', True))
+
+
+# Per-query coalescing counts are only shown to admins
+class CoalescingStatsTests(SimpleTestCase):
+    def test_anonymous_callers_are_refused(self):
+        response = self.client.get('/api/resale/coalescing_stats/')
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_admins_see_the_counts(self):
+        request = APIRequestFactory().get('/api/resale/coalescing_stats/')
+        force_authenticate(request, user=get_user_model()(is_staff=True))
+        response = coalescing_stats(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('keys', response.data)
 
-# Create your tests here.
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from .dataset import match_flat_types
+
+# Moving-average window (in months) of the trends endpoint unless given, and its upper bound
+TREND_WINDOW = 12
+TREND_MAX_WINDOW = 120
+
+
+# Running (prefix) totals of transaction count and price sum along the months of every
+# town x flat_type series, built once from the cube. Index -1 of the flat_type axis is
+# "all flat types". The count or sum of any month range of a series is the difference of
+# two entries, so a moving average, its year-over-year change or growth over a window
+# costs the same for every point whatever the window length.
+class PriceTrends:
+    def __init__(self, towns, flat_types, first_month, count, total):
+        self.towns = towns
+        self.flat_types = flat_types
+        self.first_month = first_month
+        self.count = count
+        self.total = total
+
+    @classmethod
+    def from_cube(cls, cube):
+        count = cube.count
+        total = cube.total + cube.shift * count
+
+        # Append the "all flat types" series, then accumulate along the months; entry i
+        # holds the totals of the first i months
+        prefix = []
+        for values in (count, total):
+            values = np.concatenate([values, values.sum(axis=1, keepdims=True)], axis=1)
+            running = np.zeros(values.shape[:2] + (values.shape[2] + 1,), dtype=values.dtype)
+            np.cumsum(values, axis=2, out=running[:, :, 1:])
+            prefix.append(running)
+
+        return cls(cube.towns, cube.flat_types, cube.first_month, *prefix)
+
+    @property
+    def last_month(self):
+        return self.first_month + self.count.shape[2] - 2
+
+    def town_positions(self, labels):
+        positions = pd.Index(self.towns).get_indexer(labels)
+        return np.unique(positions[positions >= 0])
+
+    # Position of a query flat type ("4-room" finds "4 ROOM") on the flat_type axis (-1 for
+    # all flat types), or None if unknown
+    def flat_type_position(self, flat_type=None):
+        if flat_type is None:
+            return -1
+        matches = pd.Index(self.flat_types).get_indexer(match_flat_types(self.flat_types, [flat_type]))
+        return matches[0] if len(matches) else None
+
+    # Count and average price of the `window` months ending at each given month, for every
+    # selected town (one row per town). Months outside the data count as empty.
+    def moving_average(self, town_pos, flat_type_pos, months, window):
+        size = self.count.shape[2] - 1
+        ends = np.clip(np.asarray(months) - self.first_month + 1, 0, size)
+        starts = np.clip(np.asarray(months) - self.first_month + 1 - window, 0, size)
+
+        count = self.count[town_pos, flat_type_pos]
+        total = self.total[town_pos, flat_type_pos]
+        counts = count[:, ends] - count[:, starts]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = np.where(counts > 0, (total[:, ends] - total[:, starts]) / counts, np.nan)
+        return counts, averages
+
+    # Moving average, year-over-year change of the moving average, and its compound annual
+    # growth since the first month, for every month start..end (clipped to the data) and
+    # town. Returns a frame with one row per (town, month) that has sales in its window.
+    def summarise(self, towns, flat_type=None, start=None, end=None, window=TREND_WINDOW):
+        columns = ['town', 'month', 'count', 'moving_avg', 'yoy', 'cagr']
+        town_pos = self.town_positions(towns)
+        flat_type_pos = self.flat_type_position(flat_type)
+        start = self.first_month if start is None else max(start, self.first_month)
+        end = self.last_month if end is None else min(end, self.last_month)
+
+        if flat_type_pos is None or not len(town_pos) or start > end:
+            return pd.DataFrame(columns=columns)
+
+        months = np.arange(start, end + 1)
+        counts, averages = self.moving_average(town_pos, flat_type_pos, months, window)
+        _, year_before = self.moving_average(town_pos, flat_type_pos, months - 12, window)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            yoy = averages / year_before - 1
+            years = (months - start) / 12
+            cagr = np.where(years > 0, (averages / averages[:, :1]) ** (1 / np.where(years > 0, years, 1)) - 1, np.nan)
+
+        town_index, month_index = np.nonzero(counts)
+        return pd.DataFrame({
+            'town': self.towns[town_pos][town_index],
+            'month': months[month_index],
+            'count': counts[town_index, month_index],
+            'moving_avg': averages[town_index, month_index],
+            'yoy': yoy[town_index, month_index],
+            'cagr': cagr[town_index, month_index],
+        }, columns=columns)
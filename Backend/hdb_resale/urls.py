@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, async_views
 
 urlpatterns = [
     path('towns/', views.get_towns, name='get_towns'),
@@ -7,7 +7,33 @@ urlpatterns = [
     path('resale_analysis/', views.resale_analysis, name='resale_analysis'),
     path("resale_comparison/", views.resale_comparison),
     path('comparison_graph/', views.comparison_graph, name='comparison_graph'),
+    path('trends/', views.resale_trends, name='resale_trends'),
     path("resale_roomtype_trends/", views.resale_roomtype_trends, name='resale_roomtype_trends'),
     path("raw_data_by_town/",views.raw_data_by_town, name='raw_data_by_town'),
+    path('search/', views.search_transactions, name='search_transactions'),
+    path('block_history/', views.block_history, name='block_history'),
     path('ai_predict/', views.ai_price_prediction, name='ai_price_prediction'),
-]
\ No newline at end of file
+    path('batch/', views.resale_batch, name='resale_batch'),
+    path('ai_predict_bulk/', views.ai_price_prediction_bulk, name='ai_price_prediction_bulk'),
+    path('ai_predict/cache_stats/', views.forecast_cache_stats, name='forecast_cache_stats'),
+    path('coalescing_stats/', views.coalescing_stats, name='coalescing_stats'),
+    path('reload_dataset/', views.reload_dataset, name='reload_dataset'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('profiling/', views.profiling, name='profiling'),
+    path('profiling/<str:view_name>/', views.profiling_download, name='profiling_download'),
+
+    # async variants of the read endpoints, for ASGI deployments
+    path('async/towns/', async_views.get_towns, name='async_get_towns'),
+    path('async/years/', async_views.get_years, name='async_get_years'),
+    path('async/resale_analysis/', async_views.resale_analysis, name='async_resale_analysis'),
+    path('async/resale_comparison/', async_views.resale_comparison, name='async_resale_comparison'),
+    path('async/comparison_graph/', async_views.comparison_graph, name='async_comparison_graph'),
+    path('async/trends/', async_views.resale_trends, name='async_resale_trends'),
+    path('async/resale_roomtype_trends/', async_views.resale_roomtype_trends, name='async_resale_roomtype_trends'),
+    path('async/raw_data_by_town/', async_views.raw_data_by_town, name='async_raw_data_by_town'),
+    path('async/search/', async_views.search_transactions, name='async_search_transactions'),
+    path('async/block_history/', async_views.block_history, name='async_block_history'),
+    path('async/ai_predict/', async_views.ai_price_prediction, name='async_ai_price_prediction'),
+    path('async/ai_predict_bulk/', async_views.ai_price_prediction_bulk, name='async_ai_price_prediction_bulk'),
+    path('async/batch/', async_views.resale_batch, name='async_resale_batch'),
+]
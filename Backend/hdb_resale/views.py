@@ -1,227 +1,702 @@
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes, permission_classes
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework import status
-from .ai_prediction import predict_prices_for_town
+from django.http import HttpResponse, QueryDict, StreamingHttpResponse
+from rest_framework.permissions import IsAdminUser
+from .dataset import category_codes, match_flat_types, month_range, month_labels
+from .registry import registry
+from .renderers import Columns, ResaleJSONRenderer, ColumnarJSONRenderer
+from .caching import cached_response, response_flights
+from .cube import CubeSlices, year_range
+from .trends import TREND_WINDOW, TREND_MAX_WINDOW
+from .instrumentation import span, render_metrics
+from .profiling import get_profiling_state, set_profiling_state, profiled_views, merge_view_profiles, clear_profiles, parse_flag
+import numpy as np
 import pandas as pd
-import os
 import json
+import os
+
+# raw_data_by_town paging and streaming limits
+RAW_DATA_MAX_PAGE_SIZE = 5000
+RAW_DATA_STREAM_CHUNK = 1000
+RAW_DATA_STREAM_TYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
 
-# load and prepare hdb resale data
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(BASE_DIR, "data", "hdb_resale_prices_data.csv")
+# search results per page unless `limit` is given (at most RAW_DATA_MAX_PAGE_SIZE)
+SEARCH_PAGE_SIZE = 50
 
-if not os.path.exists(DATA_FILE):
-    raise FileNotFoundError("Data file not found. Ensure 'hdb_resale_prices_data.csv' is available.")
+# records by default, ?format=columnar for column arrays
+RESALE_RENDERERS = [ResaleJSONRenderer, ColumnarJSONRenderer, BrowsableAPIRenderer]
 
-df = pd.read_csv(DATA_FILE)
-df.dropna(inplace=True)
-df.drop_duplicates(inplace=True)
-df['resale_price'] = pd.to_numeric(df['resale_price'], errors='coerce')
-df['month'] = pd.to_datetime(df['month'], errors='coerce')
-df['year'] = df['month'].dt.year
-df['town'] = df['town'].str.upper()
-df['flat_type'] = df['flat_type'].str.upper()
+# hdb resale data is loaded on first use through registry.current() (warmed at startup
+# by HdbResaleConfig.ready() when serving)
+
+# rendered responses are cached per normalised query and dataset version, with ETags
+cache_resale_response = cached_response(lambda: registry.current().version, lambda: registry.current().modified)
 
 # get list of towns
+@cache_resale_response
 @api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
 def get_towns(request):
+    df = registry.current().df
     towns = df['town'].unique().tolist()
     return Response({'towns': towns}, status=status.HTTP_200_OK)
 
 # get list of years
+@cache_resale_response
 @api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
 def get_years(request):
+    df = registry.current().df
     years = df['year'].unique().tolist()
     return Response({'years': sorted(years)}, status=status.HTTP_200_OK)
 
-# Return resale price trends by Town for a single Room Type
-@api_view(['GET'])
-def resale_analysis(request):
-    towns = request.GET.getlist('towns')
-    analysis_type = request.GET.get('type', 'price_trends')
-    start_year = request.GET.get('start_year')
-    end_year = request.GET.get('end_year')
-    room_type = request.GET.get('room_type')
+# resale_analysis types served from the per-year price analytics: statistic -> output column
+ANALYSIS_STATISTICS = {
+    'price_per_sqm': {'price_per_sqm': 'price_per_sqm'},
+    'percentiles': {'p10': 'p10', 'p50': 'p50', 'p90': 'p90'},
+    'lease_adjusted': {'lease_adjusted': 'resale_price'},
+}
+
+# resale_analysis types answered per town over the whole year range from the quantile sketches
+ANALYSIS_QUANTILES = {'median': 0.5, 'p25': 0.25, 'p75': 0.75, 'p90': 0.9}
+
+# Each resale query below is a function of the query parameters, the dataset and a
+# CubeSlices over its cube, returning (data, status). The views run one query against the
+# current dataset; resale_batch runs several against the same dataset and shared slices.
+def _respond(query, request):
+    dataset = registry.current()
+    data, status_code = query(request.GET, dataset, CubeSlices(dataset.cube))
+    return Response(data, status=status_code)
+
+
+# Parse the start_year/end_year ('YYYY') parameters into (start_year, end_year), both None
+# unless both are given, or return an error response
+def _query_years(params):
+    start_year = params.get('start_year')
+    end_year = params.get('end_year')
+
+    if not start_year or not end_year:
+        return (None, None), None
+
+    try:
+        return (int(start_year), int(end_year)), None
+    except ValueError:
+        return None, ({'error': 'Invalid year. Use YYYY.'}, status.HTTP_400_BAD_REQUEST)
+
+
+# Resale price trends (or volatility) by town, or by room type for a single town selection
+def analysis_query(params, dataset, slices):
+    towns = params.getlist('towns')
+    analysis_type = params.get('type', 'price_trends')
+    room_type = params.get('room_type')
 
     if not towns:
-        return Response({'error': 'No towns selected'}, status=status.HTTP_400_BAD_REQUEST)
+        return {'error': 'No towns selected'}, status.HTTP_400_BAD_REQUEST
 
-    filtered_df = df[df['town'].isin([t.upper() for t in towns])]
+    years, error = _query_years(params)
+    if error:
+        return error
+    start_year, end_year = years
 
-    if room_type:
-        filtered_df = filtered_df[filtered_df['flat_type'] == room_type.upper().strip().replace("-", " ")]
+    if analysis_type in ANALYSIS_STATISTICS:
+        return _analytics_query(dataset, analysis_type, towns, room_type, start_year, end_year)
 
-    if start_year and end_year:
-        filtered_df = filtered_df[
-            (filtered_df['year'] >= int(start_year)) & 
-            (filtered_df['year'] <= int(end_year))
-        ]
+    if analysis_type in ANALYSIS_QUANTILES:
+        return _quantile_query(dataset, analysis_type, towns, room_type, start_year, end_year)
 
-    if filtered_df.empty:
-        return Response([], status=status.HTTP_200_OK)
+    start = end = None
+    if start_year is not None:
+        start, end = year_range(start_year, end_year)
 
-    if analysis_type == "price_trends":
-        if room_type:
-            result = filtered_df.groupby(['town', 'year'])['resale_price'].mean().reset_index()
+    cube = slices.window([t.upper() for t in towns], start, end)
+    selection = {}
+
+    if room_type:
+        selection['flat_types'] = cube.flat_type_positions([room_type])
+
+    with span('groupby'):
+        if analysis_type == "price_trends":
+            if room_type:
+                summary = cube.summarise(['town', 'year'], **selection)
+            else:
+                summary = cube.summarise(['flat_type', 'year'], **selection)
+            value_column = 'mean'
         else:
-            result = filtered_df.groupby(['flat_type', 'year'])['resale_price'].mean().reset_index()
-    elif analysis_type == "volatility":
-        result = filtered_df.groupby(['town', 'year'])['resale_price'].std().reset_index()
-    else:
-        return Response({'error': 'Invalid analysis type.'}, status=status.HTTP_400_BAD_REQUEST)
+            summary = cube.summarise(['town', 'year'], **selection)
+            value_column = 'std'
 
-    return Response(result.to_dict(orient='records'), status=status.HTTP_200_OK)
+    if summary.empty:
+        return [], status.HTTP_200_OK
 
+    if analysis_type not in ("price_trends", "volatility"):
+        return {'error': 'Invalid analysis type.'}, status.HTTP_400_BAD_REQUEST
+
+    result = summary.drop(columns=['count', 'mean', 'std']).assign(resale_price=summary[value_column])
+
+    return Columns.from_frame(result), status.HTTP_200_OK
+
+
+# Price per sqm, median, percentiles or lease-adjusted price by town and year
+def _analytics_query(dataset, analysis_type, towns, room_type, start_year, end_year):
+    statistics = ANALYSIS_STATISTICS[analysis_type]
+
+    with span('groupby'):
+        summary = dataset.analytics.summarise(
+            list(statistics), [t.upper() for t in towns], room_type or None, start_year, end_year
+        )
+
+    if summary.empty:
+        return [], status.HTTP_200_OK
+
+    return Columns.from_frame(summary.rename(columns=statistics)), status.HTTP_200_OK
+
+
+# Median or percentile price of each town over the year range (all years if not given),
+# merged from the monthly quantile sketches
+def _quantile_query(dataset, analysis_type, towns, room_type, start_year, end_year):
+    sketches = dataset.sketches
+    town_pos = sketches.town_positions([t.upper() for t in towns])
+    flat_type_pos = sketches.flat_type_positions([room_type]) if room_type else None
+    months = year_range(start_year, end_year) if start_year is not None else (None, None)
+
+    with span('groupby'):
+        counts, values = sketches.quantiles([ANALYSIS_QUANTILES[analysis_type]], town_pos, flat_type_pos, *months)
+
+    present = counts > 0
+    if not present.any():
+        return [], status.HTTP_200_OK
+
+    return Columns(town=sketches.towns[town_pos][present], resale_price=values[present, 0]), status.HTTP_200_OK
 
-# Return resale price trends by room type for a single town
-@api_view(['GET'])
-def resale_roomtype_trends(request):
-    town = request.GET.get('town')
-    start_year = request.GET.get('start_year')
-    end_year = request.GET.get('end_year')
+
+# Average resale price by year and room type for a single town
+def roomtype_trends_query(params, dataset, slices):
+    town = params.get('town')
 
     if not town:
-        return Response({'error': 'Missing town parameter.'}, status=status.HTTP_400_BAD_REQUEST)
+        return {'error': 'Missing town parameter.'}, status.HTTP_400_BAD_REQUEST
 
-    filtered_df = df[df['town'] == town.upper()]
+    years, error = _query_years(params)
+    if error:
+        return error
 
-    if start_year and end_year:
-        filtered_df = filtered_df[
-            (filtered_df['year'] >= int(start_year)) & 
-            (filtered_df['year'] <= int(end_year))
-        ]
+    start = end = None
+    if years[0] is not None:
+        start, end = year_range(*years)
 
-    if filtered_df.empty:
-        return Response([], status=status.HTTP_200_OK)
+    cube = slices.window([town.upper()], start, end)
 
-    result = (
-        filtered_df.groupby(['year', 'flat_type'])['resale_price']
-        .mean()
-        .reset_index()
-        .rename(columns={'resale_price': 'avg_price'})
-        .sort_values(['year', 'flat_type'])
-    )
+    with span('groupby'):
+        summary = cube.summarise(['year', 'flat_type'])
 
-    return Response(result.to_dict(orient='records'), status=status.HTTP_200_OK)
+    if summary.empty:
+        return [], status.HTTP_200_OK
 
+    result = summary[['year', 'flat_type', 'mean']].rename(columns={'mean': 'avg_price'})
 
-# Return Average resale prices by Town over time (Table)
-@api_view(['GET'])
-def resale_comparison(request):
-    towns = request.GET.getlist('towns')
-    start_month = request.GET.get('start_year')
-    end_month = request.GET.get('end_year')
+    return Columns.from_frame(result), status.HTTP_200_OK
+
+
+# Parse the start_year/end_year ('YYYY-MM') parameters of the comparison queries into an
+# inclusive month range, or return an error response
+def _comparison_months(params, missing_error):
+    towns = params.getlist('towns')
+    start_month = params.get('start_year')
+    end_month = params.get('end_year')
 
     if not towns or not start_month or not end_month:
-        return Response({'error': 'Missing required parameters.'}, status=status.HTTP_400_BAD_REQUEST)
+        return None, ({'error': missing_error}, status.HTTP_400_BAD_REQUEST)
 
     try:
         start_date = pd.to_datetime(start_month)
         end_date = pd.to_datetime(end_month)
     except ValueError:
-        return Response({'error': 'Invalid date format. Use YYYY-MM.'}, status=status.HTTP_400_BAD_REQUEST)
+        return None, ({'error': 'Invalid date format. Use YYYY-MM.'}, status.HTTP_400_BAD_REQUEST)
 
-    filtered_df = df[
-        (df['town'].isin([t.upper() for t in towns])) &
-        (df['month'] >= start_date) &
-        (df['month'] <= end_date)
-    ]
+    return month_range(start_date, end_date), None
 
-    if filtered_df.empty:
-        return Response([], status=status.HTTP_200_OK)
 
-    result = (
-        filtered_df.groupby('town')['resale_price']
-        .mean()
-        .reset_index()
-        .rename(columns={'resale_price': 'avg_price'})
-    )
+# Average resale price by town over a month range (table)
+def comparison_table_query(params, dataset, slices):
+    months, error = _comparison_months(params, 'Missing required parameters.')
+    if error:
+        return error
+
+    cube = slices.window([t.upper() for t in params.getlist('towns')], *months)
+
+    with span('groupby'):
+        summary = cube.summarise(['town'])
+
+    if summary.empty:
+        return [], status.HTTP_200_OK
+
+    result = summary[['town', 'mean']].rename(columns={'mean': 'avg_price'})
+
+    return Columns.from_frame(result), status.HTTP_200_OK
+
+
+# Average resale price by town and month (or quarter, or year) over a month range (graph)
+def comparison_graph_query(params, dataset, slices):
+    months, error = _comparison_months(params, 'Missing parameters.')
+    if error:
+        return error
+
+    interval = params.get('interval', 'month')
+    cube = slices.window([t.upper() for t in params.getlist('towns')], *months)
+    period_column = interval if interval in ('quarter', 'year') else 'month'
+
+    with span('groupby'):
+        summary = cube.summarise([period_column, 'town'])
+
+    if summary.empty:
+        return [], status.HTTP_200_OK
+
+    grouped = pd.DataFrame({
+        'date': cube.period_labels(summary[period_column], period_column),
+        'town': summary['town'],
+        'avg_price': summary['mean'],
+    })
+
+    return Columns.from_frame(grouped), status.HTTP_200_OK
+
+
+# Moving average of the resale price by town and month over a month range, with its
+# year-over-year change and compound annual growth since the start of the range. `window`
+# is the moving-average length in months (default 12).
+def trends_query(params, dataset, slices):
+    months, error = _comparison_months(params, 'Missing parameters.')
+    if error:
+        return error
+
+    room_type = params.get('room_type')
+    try:
+        window = int(params.get('window', TREND_WINDOW))
+    except ValueError:
+        window = 0
+    if not 0 < window <= TREND_MAX_WINDOW:
+        return {'error': f'Invalid window. Use 1 to {TREND_MAX_WINDOW} months.'}, status.HTTP_400_BAD_REQUEST
+
+    with span('groupby'):
+        summary = dataset.trends.summarise(
+            [t.upper() for t in params.getlist('towns')], room_type or None,
+            *months, window=window,
+        )
+
+    if summary.empty:
+        return [], status.HTTP_200_OK
+
+    result = summary.drop(columns=['month']).assign(date=month_labels(summary['month'].to_numpy()))
+
+    return Columns.from_frame(result[['date', 'town', 'count', 'moving_avg', 'yoy', 'cagr']]), status.HTTP_200_OK
+
+
+# Forecast of the next five years of resale prices for a town
+def prediction_query(params, dataset, slices):
+    town = params.get('town')
+    flat_type = params.get('flat_type')
+
+    if not town:
+        return {'error': 'Missing required parameter: town'}, status.HTTP_400_BAD_REQUEST
+
+    result = dataset.forecast_cache.get_or_compute(dataset.forecasts.predict, town, years=5, base_year=2025, flat_type=flat_type)
+
+    if "error" in result:
+        return result, status.HTTP_400_BAD_REQUEST
 
-    return Response(result.to_dict(orient='records'), status=status.HTTP_200_OK)
+    return result, status.HTTP_200_OK
+
+
+# Return resale price trends by Town for a single Room Type
+@cache_resale_response
+@api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
+def resale_analysis(request):
+    return _respond(analysis_query, request)
+
+
+# Return resale price trends by room type for a single town
+@cache_resale_response
+@api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
+def resale_roomtype_trends(request):
+    return _respond(roomtype_trends_query, request)
+
+
+# Return Average resale prices by Town over time (Table)
+@cache_resale_response
+@api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
+def resale_comparison(request):
+    return _respond(comparison_table_query, request)
 
 
 # Return Average resale prices by Town over time (Graph)
+@cache_resale_response
 @api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
 def comparison_graph(request):
-    towns = request.GET.getlist('towns')
-    start_month = request.GET.get('start_year')
-    end_month = request.GET.get('end_year')
-    interval = request.GET.get('interval', 'month')
+    return _respond(comparison_graph_query, request)
 
-    if not towns or not start_month or not end_month:
-        return Response({'error': 'Missing parameters.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    try:
-        start_date = pd.to_datetime(start_month)
-        end_date = pd.to_datetime(end_month)
-    except ValueError:
-        return Response({'error': 'Invalid date format. Use YYYY-MM.'}, status=status.HTTP_400_BAD_REQUEST)
+# Return moving averages and growth of resale prices by Town over time
+@cache_resale_response
+@api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
+def resale_trends(request):
+    return _respond(trends_query, request)
+
+
+# Queries that can be combined in one resale_batch request, by endpoint name
+BATCH_QUERIES = {
+    'resale_analysis': analysis_query,
+    'resale_roomtype_trends': roomtype_trends_query,
+    'resale_comparison': comparison_table_query,
+    'comparison_graph': comparison_graph_query,
+    'resale_trends': trends_query,
+    'ai_predict': prediction_query,
+}
+BATCH_MAX_QUERIES = 20
+
+
+# Query parameters of a batched query as a QueryDict (list values become repeated params)
+def _batch_params(params):
+    query = QueryDict(mutable=True)
+    for name, value in params.items():
+        query.setlist(name, [str(item) for item in value] if isinstance(value, list) else [str(value)])
+    return query
+
+
+# Run several resale queries in one request, all against the same dataset version, so
+# queries over the same towns and dates (e.g. the comparison table and graph) share one
+# slice of the aggregates. Body: {"queries": [{"id": "table", "query": "resale_comparison",
+# "params": {"towns": ["BEDOK"], "start_year": "2020-01", "end_year": "2024-12"}}, ...]}.
+# Each result carries the status and data the single endpoint would have returned; a query
+# whose parameters cannot be parsed gets a 400 result and the others still run.
+@api_view(['POST'])
+@renderer_classes(RESALE_RENDERERS)
+def resale_batch(request):
+    queries = request.data.get('queries') if isinstance(request.data, dict) else None
+
+    if not isinstance(queries, list) or not queries:
+        return Response({'error': 'Missing queries.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if len(queries) > BATCH_MAX_QUERIES:
+        return Response({'error': f'At most {BATCH_MAX_QUERIES} queries per batch.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    dataset = registry.current()
+    slices = CubeSlices(dataset.cube)
+    columnar = request.accepted_renderer.format == 'columnar'
+    results = []
+
+    for index, item in enumerate(queries):
+        item = item if isinstance(item, dict) else {}
+        query = BATCH_QUERIES.get(item.get('query'))
+        params = item.get('params', {})
+
+        if query is None or not isinstance(params, dict):
+            data, status_code = {'error': 'Invalid query.'}, status.HTTP_400_BAD_REQUEST
+        else:
+            try:
+                data, status_code = query(_batch_params(params), dataset, slices)
+            except (TypeError, ValueError):
+                data, status_code = {'error': 'Invalid query parameters.'}, status.HTTP_400_BAD_REQUEST
 
-    filtered_df = df[
-        (df['town'].isin([t.upper() for t in towns])) &
-        (df['month'] >= start_date) &
-        (df['month'] <= end_date)
-    ]
+        if isinstance(data, Columns):
+            with span('to_dict'):
+                data = data.to_lists() if columnar else data.to_records()
 
-    if filtered_df.empty:
-        return Response([], status=status.HTTP_200_OK)
+        results.append({'id': item.get('id', index), 'status': status_code, 'data': data})
 
-    if interval == 'year':
-        filtered_df['period'] = filtered_df['month'].dt.year.astype(str)
-    else:
-        filtered_df['period'] = filtered_df['month'].dt.to_period('M').astype(str)
+    return Response({'version': dataset.version, 'results': results}, status=status.HTTP_200_OK)
 
-    grouped = (
-        filtered_df.groupby(['period', 'town'])['resale_price']
-        .mean()
-        .reset_index()
-        .rename(columns={'period': 'date', 'resale_price': 'avg_price'})
-    )
 
-    return Response(grouped.to_dict(orient='records'), status=status.HTTP_200_OK)
+# Decode the given rows of one column into plain Python values, straight from the arrays
+def _column_values(df, name, positions):
+    column = df[name]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = column.cat.categories.to_numpy(dtype=object)
+        return categories[column.cat.codes.to_numpy()[positions]].tolist()
+    if name == 'month':
+        return month_labels(column.to_numpy()[positions]).tolist()
+    return column.to_numpy()[positions].tolist()
+
 
+# Transaction columns for the given row positions
+def _columns(df, positions):
+    return Columns((name, _column_values(df, name, positions)) for name in df.columns)
+
+
+# Transaction records for the given row positions
+def _records(df, positions):
+    return _columns(df, positions).to_records()
+
+
+# Encode the rows chunk by chunk, so only one chunk of records is ever held in memory
+def _stream_records(df, positions, output):
+    if output == 'json':
+        yield '['
+    for chunk_start in range(0, len(positions), RAW_DATA_STREAM_CHUNK):
+        records = _records(df, positions[chunk_start:chunk_start + RAW_DATA_STREAM_CHUNK])
+        if output == 'json':
+            prefix = ',' if chunk_start else ''
+            yield prefix + ','.join(json.dumps(record) for record in records)
+        else:
+            yield ''.join(json.dumps(record) + '\n' for record in records)
+    if output == 'json':
+        yield ']'
 
-# Return All Raw Data by Town
+
+# Return All Raw Data by Town. Pass `limit` (and the returned `next_cursor`) to page
+# through the rows, or `stream=json|ndjson` to stream every row in chunks.
+@cache_resale_response
 @api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
 def raw_data_by_town(request):
     town = request.GET.get('town')
     room_type = request.GET.get('room_type')
+    limit = request.GET.get('limit')
+    cursor = request.GET.get('cursor', '0')
+    stream = request.GET.get('stream')
 
     if not town:
         return Response({'error': 'Missing required parameter (town).'}, status=status.HTTP_400_BAD_REQUEST)
 
-    start_date = pd.to_datetime('2017-01')
-    end_date = pd.to_datetime('2025-12')
+    if stream and stream not in RAW_DATA_STREAM_TYPES:
+        return Response({'error': 'Invalid stream type. Use json or ndjson.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    filtered_df = df[
-        (df['town'] == town.upper()) &
-        (df['month'] >= start_date) &
-        (df['month'] <= end_date)
-    ]
+    try:
+        cursor = int(cursor)
+        limit = int(limit) if limit else None
+    except ValueError:
+        return Response({'error': 'Invalid pagination parameters.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if room_type:
-        filtered_df = filtered_df[filtered_df['flat_type'].str.upper() == room_type.upper()]
+    if cursor < 0 or (limit is not None and not 0 < limit <= RAW_DATA_MAX_PAGE_SIZE):
+        return Response({'error': 'Invalid pagination parameters.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    if filtered_df.empty:
-        return Response([], status=status.HTTP_200_OK)
-    
-    filtered_df['month'] = filtered_df['month'].dt.strftime('%Y-%m')
+    dataset = registry.current()
+    df = dataset.df
+    start, end = month_range(pd.to_datetime('2017-01'), pd.to_datetime('2025-12'))
 
-    return Response(filtered_df.to_dict(orient='records'), status=status.HTTP_200_OK)
+    with span('filter'):
+        town_codes = category_codes(df['town'], [town.upper()])
+
+        if len(town_codes):
+            rows = dataset.town_index.rows(town_codes[0], start, end)
+            positions = np.arange(rows.start, rows.stop)
+        else:
+            rows, positions = slice(0, 0), np.arange(0)
+
+        if room_type:
+            flat_type_codes = category_codes(df['flat_type'], match_flat_types(df['flat_type'].cat.categories, [room_type]))
+            positions = positions[np.isin(df['flat_type'].cat.codes.to_numpy()[rows], flat_type_codes)]
+
+    if stream:
+        return StreamingHttpResponse(_stream_records(df, positions, stream), content_type=RAW_DATA_STREAM_TYPES[stream])
+
+    if limit is None:
+        with span('decode'):
+            columns = _columns(df, positions)
+        return Response(columns, status=status.HTTP_200_OK)
+
+    page = positions[cursor:cursor + limit]
+    next_cursor = cursor + limit if cursor + limit < len(positions) else None
+
+    with span('decode'):
+        results = _records(df, page)
+
+    return Response({
+        'count': len(positions),
+        'next_cursor': next_cursor,
+        'results': results,
+    }, status=status.HTTP_200_OK)
+
+
+# Search transactions by town, street name and block. Every word of `q` must match the
+# start of a word in the address ("tampines ave 5", "bedok 123"); with fuzzy=true, words
+# may also be misspelt. Paged like raw_data_by_town with `limit` and `cursor`.
+@cache_resale_response
+@api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
+def search_transactions(request):
+    query = request.GET.get('q', '')
+    fuzzy = parse_flag(request.GET.get('fuzzy', ''))
+
+    if not query.strip():
+        return Response({'error': 'Missing required parameter (q).'}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        cursor = int(request.GET.get('cursor', '0'))
+        limit = int(request.GET.get('limit', SEARCH_PAGE_SIZE))
+    except ValueError:
+        return Response({'error': 'Invalid pagination parameters.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if cursor < 0 or not 0 < limit <= RAW_DATA_MAX_PAGE_SIZE:
+        return Response({'error': 'Invalid pagination parameters.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    dataset = registry.current()
+
+    with span('search'):
+        positions = dataset.search_index.search(query, fuzzy=fuzzy)
+
+    page = positions[cursor:cursor + limit]
+    next_cursor = cursor + limit if cursor + limit < len(positions) else None
+
+    with span('decode'):
+        results = _records(dataset.df, page)
+
+    return Response({
+        'count': len(positions),
+        'next_cursor': next_cursor,
+        'results': results,
+    }, status=status.HTTP_200_OK)
+
+
+# Transactions of one block (town, block, street_name) in month order, with its monthly
+# transaction count and average price. Read from the block's own row range, so the town
+# is never scanned.
+@cache_resale_response
+@api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
+def block_history(request):
+    town = request.GET.get('town')
+    block = request.GET.get('block')
+    street_name = request.GET.get('street_name')
+
+    if not town or not block or not street_name:
+        return Response({'error': 'Missing required parameters (town, block, street_name).'}, status=status.HTTP_400_BAD_REQUEST)
+
+    dataset = registry.current()
+    address = dataset.addresses.find(town.upper().strip(), block.upper().strip(), ' '.join(street_name.upper().split()))
+
+    if address is None:
+        return Response({'transactions': [], 'monthly': []}, status=status.HTTP_200_OK)
+
+    df = dataset.df
+    rows = dataset.addresses.address_rows(address)
+    months = df['month'].to_numpy()[rows]
+    prices = df['resale_price'].to_numpy(dtype=np.float64)[rows]
+
+    # rows are in month order, so each month is one run
+    boundaries = np.flatnonzero(np.r_[True, months[1:] != months[:-1]])
+    count = np.diff(np.r_[boundaries, len(rows)])
+    monthly = Columns(
+        month=month_labels(months[boundaries]),
+        count=count,
+        avg_price=np.add.reduceat(prices, boundaries) / count,
+    )
+
+    with span('decode'):
+        transactions = _records(df, rows)
+
+    return Response({'transactions': transactions, 'monthly': monthly.to_records()}, status=status.HTTP_200_OK)
 
 
 # Predict future resale prices using linear regression Model
+@cache_resale_response
 @api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
 def ai_price_prediction(request):
-    town = request.GET.get('town')
+    return _respond(prediction_query, request)
+
+
+# Predict future resale prices for many towns in one request (all towns if none are given)
+@cache_resale_response
+@api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
+def ai_price_prediction_bulk(request):
+    towns = request.GET.getlist('towns') or None
     flat_type = request.GET.get('flat_type')
 
-    if not town:
-        return Response({'error': 'Missing required parameter: town'}, status=status.HTTP_400_BAD_REQUEST)
+    dataset = registry.current()
+    results = dataset.forecasts.predict_many(towns, years=5, base_year=2025, flat_type=flat_type, cache=dataset.forecast_cache)
 
-    result = predict_prices_for_town(df, town, years=5, base_year=2025, flat_type=flat_type)
+    return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+# Hit/miss counters of the forecast cache in this worker
+@api_view(['GET'])
+@renderer_classes(RESALE_RENDERERS)
+def forecast_cache_stats(request):
+    return Response(registry.current().forecast_cache.stats(), status=status.HTTP_200_OK)
 
-    if "error" in result:
-        return Response(result, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response(result, status=status.HTTP_200_OK)
\ No newline at end of file
+# Single-flight counts of this worker: per endpoint and per recent query, how many
+# requests computed a response (leads) and how many waited for an identical one (waits).
+# Admin only, as the recent queries are other users' query strings.
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+@renderer_classes(RESALE_RENDERERS)
+def coalescing_stats(request):
+    return Response(response_flights.stats(), status=status.HTTP_200_OK)
+
+
+# Rebuild the dataset from the data file in the background and swap it in (admin only).
+# This reloads the worker that handles the request; RESALE_DATASET_WATCH_INTERVAL makes
+# every worker pick up a changed data file on its own.
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def reload_dataset(request):
+    registry.reload_in_background()
+    return Response({'detail': 'Dataset reload started.', 'version': registry.current().version}, status=status.HTTP_202_ACCEPTED)
+
+
+# Request latency and phase timing histograms of this worker, in Prometheus text format
+def metrics(request):
+    dataset = registry.peek()
+    lines = []
+    if dataset is not None:
+        stats = dataset.forecast_cache.stats()
+        lines += [
+            "# HELP resale_forecast_cache_requests_total Forecast cache lookups by result.",
+            "# TYPE resale_forecast_cache_requests_total counter",
+            f'resale_forecast_cache_requests_total{{result="hit"}} {stats["hits"]}',
+            f'resale_forecast_cache_requests_total{{result="miss"}} {stats["misses"]}',
+        ]
+    groups = response_flights.stats()['groups']
+    lines += [
+        "# HELP resale_coalesced_requests_total Requests that computed a response (lead) or waited for an identical one (wait).",
+        "# TYPE resale_coalesced_requests_total counter",
+    ]
+    for path, counts in sorted(groups.items()):
+        lines.append(f'resale_coalesced_requests_total{{path="{path}",role="lead"}} {counts["leads"]}')
+        lines.append(f'resale_coalesced_requests_total{{path="{path}",role="wait"}} {counts["waits"]}')
+    return HttpResponse(render_metrics(lines), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Sampling profiler switch (admin only). GET shows the state and the profiled views,
+# POST {"enabled": true, "fraction": 0.05} switches it, DELETE discards collected profiles.
+@api_view(['GET', 'POST', 'DELETE'])
+@permission_classes([IsAdminUser])
+def profiling(request):
+    if request.method == 'POST':
+        enabled = request.data.get('enabled', True)
+        try:
+            fraction = float(request.data.get('fraction', 0.01))
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid fraction.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < fraction <= 1:
+            return Response({'error': 'Fraction must be in (0, 1].'}, status=status.HTTP_400_BAD_REQUEST)
+        set_profiling_state(enabled, fraction)
+    elif request.method == 'DELETE':
+        clear_profiles()
+
+    return Response({**get_profiling_state(), 'views': profiled_views()}, status=status.HTTP_200_OK)
+
+
+# Download the merged cProfile stats of one view (load with pstats, snakeviz or flameprof)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profiling_download(request, view_name):
+    path = merge_view_profiles(view_name)
+    if path is None:
+        return Response({'error': f'No profiles for {view_name}.'}, status=status.HTTP_404_NOT_FOUND)
+
+    with open(path, 'rb') as profile:
+        content = profile.read()
+    os.remove(path)
+
+    response = HttpResponse(content, content_type='application/octet-stream')
+    response['Content-Disposition'] = f'attachment; filename="{view_name}.prof"'
+    return response
@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'hdb_resale.instrumentation.ServerTimingMiddleware',
+    'hdb_resale.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -89,6 +91,76 @@ DATABASES = {
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# 'forecasts' holds AI price forecasts and 'responses' rendered resale API responses;
+# switch them to FileBasedCache or Redis to share entries between gunicorn workers.
+# LocMemCache evicts least recently used entries.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'forecasts': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'hdb-resale-forecasts',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2048,
+        },
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'hdb-resale-responses',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1024,
+        },
+    },
+}
+
+# Largest rendered resale response kept in the 'responses' cache, in bytes. Larger ones
+# (e.g. unpaged raw_data_by_town) still get an ETag but are recomputed on every request.
+
+RESALE_RESPONSE_CACHE_MAX_BYTES = 256 * 1024
+
+# Resale dataset
+# When set, one process writes the resale column arrays under this directory (use tmpfs,
+# e.g. /dev/shm/hdb_resale) and every worker memory-maps them read-only instead of
+# holding its own copy. The per-row address index and price quantile sketches are written
+# and mapped with them. Each worker still builds the free-text search postings (a few
+# address ids per address: ~8 MB for 400k addresses, far less for the real ~10k blocks)
+# and the town x flat_type x month tables (cube, trends, analytics: ~3 MB), which grow
+# with the number of addresses and months rather than of rows.
+
+RESALE_SHARED_DATASET_DIR = None
+
+# Seconds between checks of the resale data file; when it changes, each worker brings its
+# dataset up to date in the background and swaps it in: rows appended to the file (e.g. by
+# ingest_resale_delta) are added incrementally, any other change rebuilds it. None
+# disables the watcher.
+
+RESALE_DATASET_WATCH_INTERVAL = None
+
+# Load the resale dataset at startup. None loads it only in serving processes (runserver,
+# gunicorn, uvicorn...), so migrate, shell or test never read the data file.
+
+RESALE_WARM_ON_STARTUP = None
+
+# Directory for the sampled request profiles (switched on at /api/resale/profiling/).
+# None uses hdb_resale_profiles in the system temp directory.
+
+RESALE_PROFILE_DIR = None
+
+# Async resale endpoints (api/resale/async/..., served under ASGI): threads running the
+# pandas work, requests admitted at once (running or waiting for a thread; more get 503),
+# and seconds before a request answers 504.
+
+RESALE_ASYNC_THREADS = 4
+RESALE_ASYNC_MAX_IN_FLIGHT = 32
+RESALE_ASYNC_TIMEOUT = 30
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -152,7 +224,7 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.JSONParser',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'hdb_resale.authentication.TimedJWTAuthentication',
     ),
 }
 